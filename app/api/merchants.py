@@ -3,11 +3,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import text
 from app.db.session import get_db
+from app.db.replica import get_read_db
 from app.models.merchant import Merchant, MerchantApiKey
-from app.models.base import TenantBase
-# Import models to register them with TenantBase metadata
-from app.models.point_rule import PointRule
-from app.models.transaction import Transaction
+from app.core.multi_tenancy import ensure_tenant_tables
+from app.db.shards import shard_registry
+from app.core.invalidation import invalidation_bus, InvalidationEvent, API_KEY, MERCHANT
+from app.services.shard_service import choose_shard, set_merchant_shard
 from sqlalchemy.exc import IntegrityError
 import secrets
 from datetime import timedelta
@@ -32,30 +33,25 @@ async def register_merchant(name: str, db: AsyncSession = Depends(get_db)):
         logger(f"商戶註冊失敗，名稱已存在: {name}", "ERROR")
         raise HTTPException(status_code=400, detail="Merchant already exists")
 
-    # Multi-tenancy: create schema and tables for merchant
-    schema_name = f"merchant_{merchant.id}"
-    await db.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema_name}"'))
-    await db.commit()
-    # Set search_path and create tables in new schema
-    await db.execute(text(f'SET search_path TO "{schema_name}", public'))
-    
-    # Create tables in the new schema using engine
-    from app.db.session import engine
-    async with engine.begin() as conn:
-        # Set schema context for table creation
-        await conn.execute(text(f'SET search_path TO "{schema_name}", public'))
-        # Create all tenant tables (point_rules and transactions) with shared metadata
-        await conn.run_sync(TenantBase.metadata.create_all)
-    
-    await db.execute(text('SET search_path TO public'))
+    # Sharding: place the new tenant on the least-loaded shard
+    shard = await choose_shard(db)
+    await set_merchant_shard(db, merchant.id, shard)
+    await invalidation_bus.publish(db, InvalidationEvent(MERCHANT, merchant.id))
     await db.commit()
 
-    logger(f"商戶註冊成功: ID={merchant.id}, Name={merchant.name}, Schema={schema_name}")
+    # Multi-tenancy: create schema and tables for merchant on its shard
+    schema_name = f"merchant_{merchant.id}"
+    async with shard_registry.get_engine(shard).begin() as conn:
+        await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema_name}"'))
+        # Create all tenant tables (point_rules, transactions, member_balances) with shared metadata
+        await ensure_tenant_tables(conn, schema_name)
+
+    logger(f"商戶註冊成功: ID={merchant.id}, Name={merchant.name}, Schema={schema_name}, Shard={shard}")
 
-    return {"code": 0, "message": "Merchant registered", "data": {"id": merchant.id, "name": merchant.name}}
+    return {"code": 0, "message": "Merchant registered", "data": {"id": merchant.id, "name": merchant.name, "shard": shard}}
 
 @router.get("/", summary="List all merchants")
-async def list_merchants(db: AsyncSession = Depends(get_db)):
+async def list_merchants(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(Merchant))
     merchants = result.scalars().all()
     return {"code": 0, "message": "success", "data": [{"id": m.id, "name": m.name, "created_at": timezone_manager.format_datetime(m.created_at)} for m in merchants]}
@@ -85,6 +81,7 @@ async def create_api_key(merchant_id: int, expires_in_days: int = 30, db: AsyncS
         is_active=True,
     )
     db.add(key)
+    await invalidation_bus.publish(db, InvalidationEvent(API_KEY, merchant_id))
     await db.commit()
     
     logger(f"API 金鑰創建成功: Merchant={merchant_id}, Key ID={key.id}")
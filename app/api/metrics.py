@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from app.core.admission import admission_controller
+
+router = APIRouter(prefix="/api/v1/metrics", tags=["metrics"])
+
+@router.get("/tenants", summary="Per-tenant admission metrics for this worker")
+async def tenant_metrics():
+    """
+    目前 worker 的租戶准入控制狀態
+
+    - **shards**：各 shard 連線名額的使用數與排隊深度
+    - **tenants**：各商戶進行中 / 排隊中的請求數、已放行與被拒絕（rate、concurrency、queue_timeout）次數
+    """
+    return {"code": 0, "message": "success", "data": admission_controller.metrics()}
@@ -1,18 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import asc, desc
 from typing import Optional, Literal
+import io
+import uuid
+from datetime import datetime
 from app.db.session import get_db
-from app.core.security import get_current_tenant, get_tenant_db
+from app.core.security import get_current_tenant, get_tenant_db, get_tenant_read_db, TenantContext
 from app.models.point_rule import PointRule
 from app.models.transaction import Transaction
-from app.services.transaction_service import insert_transaction_with_lock
+from app.services.transaction_service import (
+    insert_transaction_with_lock,
+    apply_transfer,
+    InsufficientBalanceError,
+    PointRuleNotFoundError,
+)
+from app.services.import_service import import_ledger, iter_ledger_records, LedgerImportError
+from app.db.shards import shard_registry
+from app.services.leaderboard_service import get_top_members, get_member_rank
+from app.schemas.transfer import TransferRequest
+from app.core.config import settings
+from app.core.invalidation import invalidation_bus, InvalidationEvent, POINT_RULES, MERCHANT
+from app.utils.cache import TTLCache
 from app.utils.logger import logger
 from app.utils.timezone import timezone_manager
 
 router = APIRouter(prefix="/api/v1/points", tags=["points"])
 
+# merchant_id -> 點數規則列表，規則變更時經由 invalidation bus 清除
+point_rule_cache = TTLCache(ttl=settings.point_rule_cache_ttl, maxsize=10000)
+invalidation_bus.register_cache(point_rule_cache)
+
+def _evict_point_rules(event: InvalidationEvent):
+    if event.merchant_id is None:
+        point_rule_cache.clear()
+    else:
+        point_rule_cache.pop(event.merchant_id)
+
+invalidation_bus.subscribe(POINT_RULES, _evict_point_rules)
+invalidation_bus.subscribe(MERCHANT, _evict_point_rules)
+
 # PointRule CRUD
 
 @router.post("/rules")
@@ -20,6 +48,7 @@ async def create_point_rule(
     name: str,
     rate: float,
     description: str = "",
+    tenant: TenantContext = Depends(get_current_tenant),
     db: AsyncSession = Depends(get_tenant_db)
 ):
     logger({
@@ -31,6 +60,7 @@ async def create_point_rule(
     
     rule = PointRule(name=name, rate=rate, description=description)
     db.add(rule)
+    await invalidation_bus.publish(db, InvalidationEvent(POINT_RULES, tenant.merchant.id))
     await db.commit()
     
     logger(f"積分規則創建成功: ID={rule.id}, Name={rule.name}")
@@ -39,11 +69,19 @@ async def create_point_rule(
 
 @router.get("/rules")
 async def list_point_rules(
-    db: AsyncSession = Depends(get_tenant_db)
+    tenant: TenantContext = Depends(get_current_tenant),
+    db: AsyncSession = Depends(get_tenant_read_db)
 ):
-    result = await db.execute(select(PointRule))
-    rules = result.scalars().all()
-    return {"code": 0, "message": "success", "data": [{"id": r.id, "name": r.name, "rate": r.rate, "description": r.description} for r in rules]}
+    # 只快取主庫讀到的結果，副本可能落後於剛送出的失效通知
+    use_cache = settings.cache_invalidation_enabled and invalidation_bus.connected and db is tenant.db_session
+    data = point_rule_cache.get(tenant.merchant.id) if use_cache else None
+    if data is None:
+        result = await db.execute(select(PointRule))
+        rules = result.scalars().all()
+        data = [{"id": r.id, "name": r.name, "rate": r.rate, "description": r.description} for r in rules]
+        if use_cache:
+            point_rule_cache.set(tenant.merchant.id, data)
+    return {"code": 0, "message": "success", "data": data}
 
 @router.put("/rules/{rule_id}")
 async def update_point_rule(
@@ -51,6 +89,7 @@ async def update_point_rule(
     name: str = None,
     rate: float = None,
     description: str = None,
+    tenant: TenantContext = Depends(get_current_tenant),
     db: AsyncSession = Depends(get_tenant_db)
 ):
     result = await db.execute(select(PointRule).where(PointRule.id == rule_id))
@@ -63,12 +102,14 @@ async def update_point_rule(
         rule.rate = rate
     if description is not None:
         rule.description = description
+    await invalidation_bus.publish(db, InvalidationEvent(POINT_RULES, tenant.merchant.id))
     await db.commit()
     return {"code": 0, "message": "updated", "data": {"id": rule.id, "name": rule.name, "rate": rule.rate, "description": rule.description}}
 
 @router.delete("/rules/{rule_id}")
 async def delete_point_rule(
     rule_id: int,
+    tenant: TenantContext = Depends(get_current_tenant),
     db: AsyncSession = Depends(get_tenant_db)
 ):
     result = await db.execute(select(PointRule).where(PointRule.id == rule_id))
@@ -76,9 +117,36 @@ async def delete_point_rule(
     if not rule:
         raise HTTPException(status_code=404, detail="Rule not found")
     await db.delete(rule)
+    await invalidation_bus.publish(db, InvalidationEvent(POINT_RULES, tenant.merchant.id))
     await db.commit()
     return {"code": 0, "message": "deleted", "data": None}
 
+# Leaderboard
+
+@router.get("/rules/{rule_id}/leaderboard")
+async def get_leaderboard(
+    rule_id: int,
+    limit: int = Query(default=10, ge=1, le=100, description="取前 N 名"),
+    tenant: TenantContext = Depends(get_current_tenant),
+    db: AsyncSession = Depends(get_tenant_read_db)
+):
+    """依餘額由高到低取得指定規則的前 N 名（同分同名次）"""
+    rows = await get_top_members(db, tenant.schema_name, rule_id, limit)
+    return {"code": 0, "message": "success", "data": rows}
+
+@router.get("/rules/{rule_id}/leaderboard/{uid}")
+async def get_leaderboard_rank(
+    rule_id: int,
+    uid: str,
+    tenant: TenantContext = Depends(get_current_tenant),
+    db: AsyncSession = Depends(get_tenant_read_db)
+):
+    """取得指定 uid 在規則排行榜中的名次"""
+    row = await get_member_rank(db, tenant.schema_name, rule_id, uid)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Member not found")
+    return {"code": 0, "message": "success", "data": row}
+
 # Transaction Insert Only
 
 @router.post("/transactions")
@@ -121,13 +189,115 @@ async def create_transaction(
         }
     }
 
+@router.post("/transfers")
+async def create_transfer(
+    payload: TransferRequest,
+    db: AsyncSession = Depends(get_tenant_db)
+):
+    """
+    在單一 DB 交易中套用多筆點數異動（會員間轉點、規則間兌換）
+
+    - 任一扣點會造成透支時整筆拒絕，不寫入任何流水
+    - 每筆流水的 detail 會帶上相同的 `transfer_id`
+    """
+    transfer_id = uuid.uuid4().hex
+    legs = [leg.model_dump() for leg in payload.legs]
+    logger({
+        "action": "create_transfer",
+        "transfer_id": transfer_id,
+        "legs": legs,
+        "detail": payload.detail
+    })
+
+    detail = dict(payload.detail or {})
+    detail["transfer_id"] = transfer_id
+    try:
+        txs = await apply_transfer(db=db, legs=legs, detail=detail)
+    except PointRuleNotFoundError as e:
+        logger(f"轉點失敗，規則不存在: {e.point_rule_ids}", "ERROR")
+        raise HTTPException(status_code=404, detail="Rule not found")
+    except InsufficientBalanceError as e:
+        logger(f"轉點失敗，餘額不足: UID={e.uid}, Rule={e.point_rule_id}, 餘額={e.balance}, 異動={e.amount}", "ERROR")
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+
+    logger(f"轉點成功: Transfer={transfer_id}, 交易 IDs={[tx.id for tx in txs]}")
+
+    return {
+        "code": 0,
+        "message": "created",
+        "data": {
+            "transfer_id": transfer_id,
+            "transactions": [
+                {
+                    "id": tx.id,
+                    "uid": tx.uid,
+                    "point_rule_id": tx.point_rule_id,
+                    "amount": tx.amount,
+                    "balance": tx.balance,
+                    "detail": tx.detail,
+                    "created_at": timezone_manager.format_datetime(tx.created_at)
+                }
+                for tx in txs
+            ]
+        }
+    }
+
+@router.post("/transactions/import")
+async def import_transactions(
+    file: UploadFile = File(..., description="CSV（含標題列）或 NDJSON，欄位 uid、point_rule_id、amount，可選 detail、created_at"),
+    format: Optional[Literal["csv", "ndjson"]] = Query(default=None, description="未指定時依副檔名判斷"),
+    import_key: Optional[str] = Query(default=None, description="續傳識別，預設為檔名；相同 key 重送會從上次的 offset 繼續"),
+    chunk_size: int = Query(default=10000, ge=100, le=100000),
+    defer_indexes: Optional[bool] = Query(
+        default=None, description="匯入期間移除次要索引；未指定時只在尚無流水時移除，商戶已在寫入時請勿開啟"
+    ),
+    tenant: TenantContext = Depends(get_current_tenant)
+):
+    """
+    以 COPY 匯入歷史流水（商戶上線時的資料搬遷）
+
+    - 依 uid、point_rule_id 接續計算 balance
+    - 每個 chunk 與進度一起 commit，失敗後以相同 `import_key` 重送即可續傳
+    - 商戶尚無流水時（或指定 `defer_indexes=true`）暫停 transactions 的次要索引，完成後重建
+    """
+    fmt = format or ("ndjson" if (file.filename or "").endswith((".ndjson", ".jsonl")) else "csv")
+    key = import_key or file.filename or "upload"
+    logger({
+        "action": "import_transactions",
+        "filename": file.filename,
+        "format": fmt,
+        "import_key": key
+    })
+
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    try:
+        stats = await import_ledger(
+            engine=shard_registry.get_engine(tenant.shard),
+            schema_name=tenant.schema_name,
+            records=iter_ledger_records(stream, fmt),
+            import_key=key,
+            chunk_size=chunk_size,
+            defer_indexes=defer_indexes,
+        )
+    except LedgerImportError as e:
+        logger(f"匯入失敗: Key={key}, {e}", "ERROR")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"code": 0, "message": "imported", "data": stats}
+
 @router.get("/transactions")
 async def list_transactions(
     sort: Optional[str] = Query(
         default=None,
         description="排序方式：多個排序條件用逗號分隔，如 '-id,uid,point_rule_id'。支援欄位：id、uid、point_rule_id，加 '-' 前綴表示降序"
     ),
-    db: AsyncSession = Depends(get_tenant_db)
+    uid: Optional[str] = Query(default=None, description="只回傳此會員的流水"),
+    point_rule_id: Optional[int] = Query(default=None, description="只回傳此點數規則的流水"),
+    start: Optional[datetime] = Query(default=None, description="起始時間（含），ISO 8601，未帶時區視為系統時區"),
+    end: Optional[datetime] = Query(default=None, description="結束時間（不含），ISO 8601，未帶時區視為系統時區"),
+    before_id: Optional[int] = Query(default=None, description="只回傳 id 小於此值的流水，傳入上一頁最後一筆的 id 取得下一頁"),
+    limit: Optional[int] = Query(default=None, ge=1, le=1000, description="每頁筆數；未指定時回傳全部"),
+    db: AsyncSession = Depends(get_tenant_read_db)
 ):
     """
     獲取交易記錄列表
@@ -137,8 +307,22 @@ async def list_transactions(
         - 降序請加 `-` 前綴，如：`-id`
         - 範例：`-id,uid,point_rule_id`
         - 每個欄位只取第一次出現的值
+    - **uid** / **point_rule_id** / **start** / **end**: 篩選條件
+    - **limit** / **before_id**: 以 id keyset 分頁，指定 limit 且未指定 sort 時依 id 由新到舊排序，
+      下一頁帶入 `before_id=<本頁最後一筆 id>`；不使用 OFFSET，深頁查詢成本與第一頁相同
     """
     query = select(Transaction)
+    if uid is not None:
+        query = query.where(Transaction.uid == uid)
+    if point_rule_id is not None:
+        query = query.where(Transaction.point_rule_id == point_rule_id)
+    # created_at 以系統時區的 naive datetime 儲存
+    if start is not None:
+        query = query.where(Transaction.created_at >= timezone_manager.localize(start).replace(tzinfo=None))
+    if end is not None:
+        query = query.where(Transaction.created_at < timezone_manager.localize(end).replace(tzinfo=None))
+    if before_id is not None:
+        query = query.where(Transaction.id < before_id)
     
     # 添加排序邏輯
     if sort:
@@ -166,7 +350,11 @@ async def list_transactions(
         
         if order_clauses:
             query = query.order_by(*order_clauses)
+    elif limit is not None:
+        query = query.order_by(desc(Transaction.id))
 
+    if limit is not None:
+        query = query.limit(limit)
     result = await db.execute(query)
     logs = result.scalars().all()
     return {"code": 0, "message": "success", "data": [
@@ -0,0 +1,187 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List
+from fastapi import HTTPException
+from app.core.config import settings
+from app.utils.logger import logger
+
+
+class TokenBucket:
+    """每秒補充 rate 個 token，最多累積 burst 個"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """取得一個 token，成功回傳 0，否則回傳需等待的秒數；rate <= 0 表示不限制"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class TenantState:
+    def __init__(self, max_concurrent: int, rate: float, burst: float, weight: float):
+        self.max_concurrent = max_concurrent
+        self.weight = weight
+        self.bucket = TokenBucket(rate, burst)
+        self.active = 0
+        self.queued = 0
+        self.last_finish = 0.0
+        self.admitted = 0
+        self.rejected = {"rate": 0, "concurrency": 0, "queue_timeout": 0}
+
+
+class FairScheduler:
+    """
+    以加權公平佇列（WFQ）分配某個 shard 連線池的名額
+
+    名額用完時依 virtual finish time 排隊：每個請求的 finish = max(virtual time, 該租戶上一個 finish) + 1 / weight，
+    因此大量排隊的租戶只會拉長自己的佇列，其他租戶仍以各自的權重輪流取得連線。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, tenant: TenantState, timeout: float):
+        if self.in_use < self.capacity and not self._queue:
+            self.in_use += 1
+            return
+        finish = max(self.virtual_time, tenant.last_finish) + 1.0 / tenant.weight
+        tenant.last_finish = finish
+        future = asyncio.get_running_loop().create_future()
+        entry = [finish, next(self._seq), future]
+        heapq.heappush(self._queue, entry)
+        tenant.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 逾時的同時剛好取得名額：照常使用；請求被取消則把名額交給下一位
+                if isinstance(e, asyncio.TimeoutError):
+                    return
+                self.release()
+            else:
+                future.cancel()
+            raise
+        finally:
+            tenant.queued -= 1
+
+    def release(self):
+        while self._queue:
+            finish, _, future = heapq.heappop(self._queue)
+            if future.cancelled():
+                continue
+            self.virtual_time = finish
+            future.set_result(None)
+            return
+        self.in_use -= 1
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+
+class AdmissionController:
+    """
+    依 get_current_tenant 解析出的商戶做准入控制（每個 worker 各自計算）
+
+    - token bucket 限制每秒請求數，超過回 429 並帶 Retry-After
+    - 限制每個租戶同時進行中的請求數，超過回 429
+    - 取得連線池名額時以 WFQ 排隊，排隊逾時回 429
+    """
+
+    def __init__(self):
+        self._tenants: Dict[int, TenantState] = {}
+        self._schedulers: Dict[str, FairScheduler] = {}
+
+    def _tenant(self, merchant_id: int) -> TenantState:
+        state = self._tenants.get(merchant_id)
+        if state is None:
+            limits = settings.tenant_limits.get(str(merchant_id), {})
+            state = TenantState(
+                max_concurrent=limits.get("max_concurrent", settings.tenant_max_concurrent),
+                rate=limits.get("rate", settings.tenant_rate_per_sec),
+                burst=limits.get("burst", settings.tenant_burst),
+                weight=limits.get("weight", settings.tenant_weight),
+            )
+            self._tenants[merchant_id] = state
+        return state
+
+    def _scheduler(self, shard: str) -> FairScheduler:
+        if shard not in self._schedulers:
+            slots = settings.admission_pool_slots or max(1, settings.db_pool_size + settings.db_max_overflow - 2)
+            self._schedulers[shard] = FairScheduler(slots)
+        return self._schedulers[shard]
+
+    def _reject(self, tenant: TenantState, merchant_id: int, reason: str, retry_after: float):
+        tenant.rejected[reason] += 1
+        logger(f"租戶請求被限流: Merchant={merchant_id}, Reason={reason}", "WARNING")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    @asynccontextmanager
+    async def admit(self, merchant_id: int, shard: str):
+        tenant = self._tenant(merchant_id)
+        wait = tenant.bucket.try_acquire()
+        if wait > 0:
+            self._reject(tenant, merchant_id, "rate", wait)
+        if 0 < tenant.max_concurrent <= tenant.active:
+            self._reject(tenant, merchant_id, "concurrency", 1)
+
+        tenant.active += 1
+        try:
+            scheduler = self._scheduler(shard)
+            try:
+                await scheduler.acquire(tenant, settings.admission_queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject(tenant, merchant_id, "queue_timeout", 1)
+            tenant.admitted += 1
+            try:
+                yield
+            finally:
+                scheduler.release()
+        finally:
+            tenant.active -= 1
+
+    def metrics(self) -> dict:
+        return {
+            "shards": {
+                shard: {"capacity": s.capacity, "in_use": s.in_use, "queue_depth": s.depth}
+                for shard, s in self._schedulers.items()
+            },
+            "tenants": {
+                merchant_id: {
+                    "active": t.active,
+                    "queued": t.queued,
+                    "admitted": t.admitted,
+                    "rejected": dict(t.rejected),
+                    "tokens": round(t.bucket.tokens, 2),
+                    "max_concurrent": t.max_concurrent,
+                    "weight": t.weight,
+                }
+                for merchant_id, t in self._tenants.items()
+            },
+        }
+
+
+admission_controller = AdmissionController()
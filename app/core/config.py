@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
 
@@ -18,6 +18,55 @@ class Settings(BaseSettings):
     
     # 資料庫設定
     database_url: Optional[str] = None
+    # 每個 engine（主庫、副本、各 shard）的連線池大小
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+
+    # 額外的 shard 資料庫（JSON，例如 {"shard2": "postgresql+asyncpg://..."}），主庫固定為 default shard
+    shard_database_urls: Dict[str, str] = {}
+    # 搬移租戶時，凍結寫入後等待進行中請求結束的秒數
+    shard_move_drain_seconds: float = 5.0
+
+    # 租戶准入控制（每個 worker 各自計算；rate / max_concurrent <= 0 表示不限制），預設關閉
+    admission_enabled: bool = False
+    tenant_max_concurrent: int = 10
+    tenant_rate_per_sec: float = 50.0
+    tenant_burst: float = 100.0
+    tenant_weight: float = 1.0
+    # 個別租戶覆寫（JSON），例如 {"5": {"max_concurrent": 20, "rate": 100, "burst": 200, "weight": 2}}
+    tenant_limits: Dict[str, Dict[str, Any]] = {}
+    # 每個 shard 可同時使用的連線數；未設定時為 db_pool_size + db_max_overflow - 2，
+    # 保留連線給不經准入控制的查詢（API key 驗證、read token、副本延遲檢查）
+    admission_pool_slots: Optional[int] = None
+    admission_queue_timeout: float = 5.0
+
+    # 餘額異動事件 webhook（未設定時不寫入 outbox）
+    outbox_webhook_urls: List[str] = []
+    outbox_batch_size: int = 100
+    outbox_max_attempts: int = 10
+    outbox_backoff_base: float = 1.0
+    outbox_backoff_max: float = 300.0
+    outbox_poll_interval: float = 1.0
+    outbox_http_timeout: float = 5.0
+    # 領取後的租約秒數，需大於投遞一批的最長時間（約 URL 數 × outbox_http_timeout）
+    outbox_lease_seconds: float = 60.0
+    outbox_retention_hours: float = 72.0
+    # 在 API process 中啟動 dispatcher（每個 uvicorn worker 一個）
+    outbox_dispatcher_in_app: bool = False
+
+    # 唯讀副本設定（未設定時所有查詢走主庫）
+    replica_database_url: Optional[str] = None
+    replica_max_lag_seconds: float = 5.0
+    replica_lag_check_interval: float = 1.0
+
+    # 排行榜快取秒數
+    leaderboard_cache_ttl: float = 5.0
+
+    # 跨 worker 快取（以 Postgres LISTEN/NOTIFY 同步失效）
+    cache_invalidation_enabled: bool = True
+    cache_invalidation_healthcheck_interval: float = 10.0
+    auth_cache_ttl: float = 60.0
+    point_rule_cache_ttl: float = 300.0
     
     model_config = SettingsConfigDict(env_file="app/.env", case_sensitive=False)
 
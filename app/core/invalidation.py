@@ -0,0 +1,140 @@
+import asyncio
+import json
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.utils.cache import TTLCache
+from app.utils.logger import logger
+
+CHANNEL = "point_system_invalidation"
+
+# 事件種類
+API_KEY = "api_key"          # 商戶的 API key 新增/變更
+MERCHANT = "merchant"        # 商戶資料或所在 shard / 狀態變更
+POINT_RULES = "point_rules"  # 租戶的點數規則變更
+
+
+@dataclass
+class InvalidationEvent:
+    kind: str
+    merchant_id: Optional[int] = None
+
+    def to_payload(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_payload(cls, payload: str) -> "InvalidationEvent":
+        return cls(**json.loads(payload))
+
+
+class InvalidationBus:
+    """
+    以 Postgres LISTEN/NOTIFY 在多個 uvicorn worker 之間同步快取失效
+
+    - publish 在呼叫端的 DB 交易中送出 NOTIFY，commit 後才會廣播；本 worker 的快取則立即清除
+    - 每個資料庫（主庫與各 shard）各使用一條專用的 asyncpg 連線 LISTEN
+    - 連線中斷期間不使用快取；重新連線後清空所有快取，避免漏接的訊息造成資料過期
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[InvalidationEvent], None]]] = {}
+        self._caches: List[TTLCache] = []
+        self._connected: Dict[str, bool] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    @property
+    def connected(self) -> bool:
+        """所有監聽連線都正常時才可以使用快取"""
+        return bool(self._connected) and all(self._connected.values())
+
+    def register_cache(self, cache: TTLCache):
+        """登記需要在重新連線時整個清空的快取"""
+        self._caches.append(cache)
+
+    def subscribe(self, kind: str, handler: Callable[[InvalidationEvent], None]):
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def flush_all(self):
+        for cache in self._caches:
+            cache.clear()
+
+    def _dispatch(self, event: InvalidationEvent):
+        for handler in self._handlers.get(event.kind, []):
+            try:
+                handler(event)
+            except Exception as e:
+                logger(f"快取失效處理失敗: {event}, {type(e).__name__}: {e}", "ERROR")
+
+    async def publish(self, db: AsyncSession, event: InvalidationEvent):
+        """在 db 目前的交易中送出失效事件，需由呼叫端 commit"""
+        self._dispatch(event)
+        await db.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CHANNEL, "payload": event.to_payload()}
+        )
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            event = InvalidationEvent.from_payload(payload)
+        except (TypeError, ValueError) as e:
+            logger(f"無法解析快取失效事件，清空所有快取: {payload}, {e}", "WARNING")
+            self.flush_all()
+            return
+        self._dispatch(event)
+
+    async def _listen(self, url: str):
+        dsn = make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+        delay = 1.0
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = await asyncpg.connect(dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(CHANNEL, self._on_notification)
+                # 離線期間可能漏接訊息
+                self.flush_all()
+                self._connected[url] = True
+                delay = 1.0
+                logger("快取失效監聽已連線")
+                while not self._stopping.is_set() and not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), timeout=settings.cache_invalidation_healthcheck_interval)
+                    except asyncio.TimeoutError:
+                        # 定期確認連線仍可用，偵測不會觸發 termination 的斷線
+                        await asyncio.wait_for(conn.execute("SELECT 1"), timeout=5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger(f"快取失效監聽中斷: {type(e).__name__}: {e}", "WARNING")
+            finally:
+                self._connected[url] = False
+                self.flush_all()
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+            if not self._stopping.is_set():
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def start(self, urls: List[str]):
+        self._stopping.clear()
+        for url in dict.fromkeys(urls):
+            self._connected[url] = False
+            self._tasks.append(asyncio.create_task(self._listen(url)))
+
+    async def stop(self):
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._connected = {}
+
+
+invalidation_bus = InvalidationBus()
+
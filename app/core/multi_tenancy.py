@@ -1,8 +1,53 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import text
+from sqlalchemy import event, text
+from app.models.base import TenantBase
+# Import models to register them with TenantBase metadata
+from app.models.point_rule import PointRule
+from app.models.transaction import Transaction
+from app.models.member_balance import MemberBalance
+from app.models.ledger_import import LedgerImport
+from app.models.outbox_event import OutboxEvent
 
 async def set_search_path(session: AsyncSession, schema: str):
     """
     Set PostgreSQL schema (search_path) for the current session.
+
+    The path is set transaction-locally and applied whenever the session
+    begins a transaction, so it follows the session across commits (which
+    may check out a different pooled connection) and never leaks into
+    connections returned to the pool. Nothing is executed up front: a
+    session that is never used (e.g. a request served from the replica)
+    never checks out a connection.
+    """
+    path = f'"{schema}", public'
+
+    def _apply_search_path(sync_session, transaction, connection):
+        connection.execute(text("SELECT set_config('search_path', :path, true)"), {"path": path})
+
+    event.listen(session.sync_session, "after_begin", _apply_search_path)
+    if session.in_transaction():
+        # 已開始的交易不會再觸發 after_begin
+        await session.execute(text("SELECT set_config('search_path', :path, true)"), {"path": path})
+
+async def ensure_tenant_tables(conn, schema: str):
     """
-    await session.execute(text(f'SET search_path TO "{schema}", public'))
+    Create missing tenant tables in the given schema.
+
+    Tables added after a merchant was registered (e.g. member_balances)
+    are created here and backfilled from the existing ledger. Indexes
+    added to existing tables are not built here (that would block writes
+    while holding the startup transaction); run app.tools.build_indexes,
+    which builds them concurrently.
+    """
+    from app.services.leaderboard_service import rebuild_member_balances
+
+    result = await conn.execute(
+        text("SELECT to_regclass(:name)"), {"name": f'"{schema}".member_balances'}
+    )
+    needs_backfill = result.scalar() is None
+
+    await conn.execute(text(f'SET search_path TO "{schema}", public'))
+    await conn.run_sync(TenantBase.metadata.create_all)
+    if needs_backfill:
+        await rebuild_member_balances(conn)
+    await conn.execute(text('SET search_path TO public'))
@@ -1,38 +1,115 @@
 from fastapi import Header, HTTPException, Depends, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from app.db.session import get_db
-from app.models.merchant import MerchantApiKey, Merchant
+from app.db.session import get_db, ReplicaSessionLocal
+from app.db.replica import replica_router
+from app.db.shards import shard_registry, DEFAULT_SHARD
+from app.models.merchant import MerchantApiKey, Merchant, MerchantShard
+from app.core.config import settings
 from app.core.multi_tenancy import set_search_path
+from app.core.invalidation import invalidation_bus, InvalidationEvent, API_KEY, MERCHANT
+from app.core.admission import admission_controller
+from app.utils.cache import TTLCache
+from contextlib import nullcontext
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Optional
+
+@dataclass(frozen=True)
+class MerchantInfo:
+    id: int
+    name: str
+
+@dataclass(frozen=True)
+class ApiKeyAuth:
+    """API key 驗證結果；只保存純值，ORM 物件會隨 request session rollback 過期而無法跨請求重用"""
+    merchant: MerchantInfo
+    expires_at: Optional[datetime]
+    shard: str
+    status: str
+
+# x-api-key -> ApiKeyAuth，商戶或 key 變更時經由 invalidation bus 清除
+auth_cache = TTLCache(ttl=settings.auth_cache_ttl, maxsize=10000)
+invalidation_bus.register_cache(auth_cache)
+
+def _evict_merchant_keys(event: InvalidationEvent):
+    if event.merchant_id is None:
+        auth_cache.clear()
+    else:
+        auth_cache.invalidate(lambda key, value: value.merchant.id == event.merchant_id)
+
+invalidation_bus.subscribe(API_KEY, _evict_merchant_keys)
+invalidation_bus.subscribe(MERCHANT, _evict_merchant_keys)
 
 class TenantContext:
-    def __init__(self, merchant, schema_name, db_session):
+    def __init__(self, merchant, schema_name, db_session, shard=DEFAULT_SHARD):
         self.merchant = merchant
         self.schema_name = schema_name
         self.db_session = db_session
+        self.shard = shard
+
+def _use_cache() -> bool:
+    # 失效通知連線中斷時不使用快取，避免讀到其他 worker 已變更的資料
+    return settings.cache_invalidation_enabled and invalidation_bus.connected
 
 async def get_current_tenant(
     x_api_key: str = Header(..., alias="x-api-key"),
     db: AsyncSession = Depends(get_db)
 ):
-    # 查詢 API key
-    result = await db.execute(
-        select(MerchantApiKey, Merchant)
-        .join(Merchant, MerchantApiKey.merchant_id == Merchant.id)
-        .where(MerchantApiKey.api_key == x_api_key)
-        .where(MerchantApiKey.is_active == True)
-        .where((MerchantApiKey.expires_at == None) | (MerchantApiKey.expires_at > datetime.now()))
-    )
-    row = result.first()
-    if not row:
-        raise HTTPException(status_code=401, detail="Invalid or expired x-api-key")
-    api_key, merchant = row
-    # 切換 schema
-    schema_name = f"merchant_{merchant.id}"
-    await set_search_path(db, schema_name)
-    return TenantContext(merchant, schema_name, db)
+    auth = auth_cache.get(x_api_key) if _use_cache() else None
+    if auth is None or (auth.expires_at is not None and auth.expires_at <= datetime.now()):
+        # 查詢 API key
+        result = await db.execute(
+            select(
+                Merchant.id, Merchant.name, MerchantApiKey.expires_at, MerchantShard.shard, MerchantShard.status
+            )
+            .join(Merchant, MerchantApiKey.merchant_id == Merchant.id)
+            .outerjoin(MerchantShard, MerchantShard.merchant_id == Merchant.id)
+            .where(MerchantApiKey.api_key == x_api_key)
+            .where(MerchantApiKey.is_active == True)
+            .where((MerchantApiKey.expires_at == None) | (MerchantApiKey.expires_at > datetime.now()))
+        )
+        row = result.first()
+        if not row:
+            raise HTTPException(status_code=401, detail="Invalid or expired x-api-key")
+        merchant_id, merchant_name, expires_at, shard, status = row
+        auth = ApiKeyAuth(MerchantInfo(merchant_id, merchant_name), expires_at, shard or DEFAULT_SHARD, status or "active")
+        if _use_cache():
+            auth_cache.set(x_api_key, auth)
+        # 先歸還驗證查詢用的連線，之後的連線名額由准入控制排隊分配
+        await db.commit()
+    merchant, shard = auth.merchant, auth.shard
+    if auth.status == "moving":
+        raise HTTPException(
+            status_code=503,
+            detail="Tenant is being moved, retry later",
+            headers={"Retry-After": str(int(settings.shard_move_drain_seconds) + 1)},
+        )
+    admission = admission_controller.admit(merchant.id, shard) if settings.admission_enabled else nullcontext()
+    async with admission:
+        # 切換 schema
+        schema_name = f"merchant_{merchant.id}"
+        if shard == DEFAULT_SHARD:
+            await set_search_path(db, schema_name)
+            yield TenantContext(merchant, schema_name, db, shard)
+            return
+        # 租戶在其他 shard：改用該 shard 連線池的 session
+        async with shard_registry.session(shard) as tenant_db:
+            await set_search_path(tenant_db, schema_name)
+            yield TenantContext(merchant, schema_name, tenant_db, shard)
 
 async def get_tenant_db(tenant: TenantContext = Depends(get_current_tenant)) -> AsyncSession:
     """取得已設定好租戶 schema 的資料庫 session"""
     return tenant.db_session
+
+async def get_tenant_read_db(
+    tenant: TenantContext = Depends(get_current_tenant),
+    x_read_token: Optional[str] = Header(None, alias="x-read-token")
+):
+    """取得唯讀查詢用的租戶 session：副本可用且夠新時走副本，否則沿用租戶 session（副本僅涵蓋 default shard）"""
+    if tenant.shard != DEFAULT_SHARD or not await replica_router.use_replica(x_read_token):
+        yield tenant.db_session
+        return
+    async with ReplicaSessionLocal() as session:
+        await set_search_path(session, tenant.schema_name)
+        yield session
@@ -0,0 +1,125 @@
+import re
+import time
+from typing import Optional
+from fastapi import Header
+from sqlalchemy import text
+from app.core.config import settings
+from app.db.session import engine, AsyncSessionLocal, replica_engine, ReplicaSessionLocal
+from app.utils.logger import logger
+
+# pg_lsn 文字格式，例如 0/16B3748
+_LSN_PATTERN = re.compile(r"^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$")
+
+def parse_lsn(lsn: Optional[str]) -> Optional[int]:
+    """將 pg_lsn 文字轉為可比較的整數"""
+    if not lsn or not _LSN_PATTERN.match(lsn):
+        return None
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+def estimate_replica_lag(
+    primary_lsn: Optional[str],
+    replay_lsn: Optional[str],
+    replay_age: Optional[float],
+    receiver_status: Optional[str],
+) -> Optional[float]:
+    """
+    估計副本延遲秒數，無法判斷時回傳 None
+
+    - 副本已重播到主庫目前位置：0（主庫閒置時也不會誤判為延遲）
+    - 尚未追上：以最後重播交易距今的秒數估計
+    - WAL receiver 未在 streaming 且尚未追上：視為無法判斷，避免斷線的副本被當成最新
+    """
+    primary, replayed = parse_lsn(primary_lsn), parse_lsn(replay_lsn)
+    if primary is None or replayed is None:
+        return None
+    if replayed >= primary:
+        return 0.0
+    if receiver_status != "streaming" or replay_age is None:
+        return None
+    return max(float(replay_age), 0.0)
+
+class ReplicaRouter:
+    """
+    決定唯讀查詢是否可以走副本
+
+    - 副本延遲超過 replica_max_lag_seconds 時改走主庫
+    - 帶有 read token（寫入後取得的主庫 WAL 位置）時，副本必須已重播到該位置
+    - 副本連線失敗時改走主庫
+    """
+
+    def __init__(self):
+        self._lag_checked_at = 0.0
+        self._lag_ok = False
+
+    @property
+    def enabled(self) -> bool:
+        return replica_engine is not None
+
+    async def _probe_lag(self) -> Optional[float]:
+        """以主庫目前的 WAL 位置比對副本的重播進度，回傳延遲秒數；無法判斷時回傳 None"""
+        # 先讀主庫位置：副本重播到此位置即代表讀取當下已追上
+        async with engine.connect() as conn:
+            result = await conn.execute(text("SELECT pg_current_wal_lsn()::text"))
+            primary_lsn = result.scalar()
+        async with replica_engine.connect() as conn:
+            result = await conn.execute(text("""
+                SELECT pg_last_wal_replay_lsn()::text,
+                       EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()),
+                       (SELECT status FROM pg_stat_wal_receiver)
+            """))
+            replay_lsn, replay_age, receiver_status = result.one()
+        return estimate_replica_lag(primary_lsn, replay_lsn, replay_age, receiver_status)
+
+    async def _check_lag(self) -> bool:
+        now = time.monotonic()
+        if now - self._lag_checked_at < settings.replica_lag_check_interval:
+            return self._lag_ok
+        self._lag_checked_at = now
+        try:
+            lag = await self._probe_lag()
+        except Exception as e:
+            logger(f"副本延遲檢查失敗，改走主庫: {type(e).__name__}: {e}", "WARNING")
+            self._lag_ok = False
+            return False
+        self._lag_ok = lag is not None and lag <= settings.replica_max_lag_seconds
+        if not self._lag_ok:
+            logger(f"副本延遲 {'未知' if lag is None else f'{lag:.2f}s'} 超過上限，改走主庫", "WARNING")
+        return self._lag_ok
+
+    async def _has_replayed(self, read_token: str) -> bool:
+        if not _LSN_PATTERN.match(read_token):
+            return False
+        try:
+            async with replica_engine.connect() as conn:
+                result = await conn.execute(
+                    text("SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)"),
+                    {"lsn": read_token}
+                )
+                return bool(result.scalar())
+        except Exception as e:
+            logger(f"副本 read token 檢查失敗，改走主庫: {type(e).__name__}: {e}", "WARNING")
+            return False
+
+    async def use_replica(self, read_token: Optional[str] = None) -> bool:
+        if not self.enabled:
+            return False
+        if not await self._check_lag():
+            return False
+        if read_token:
+            return await self._has_replayed(read_token)
+        return True
+
+replica_router = ReplicaRouter()
+
+async def current_read_token() -> str:
+    """取得主庫目前的 WAL 位置，作為 read-your-writes token 回傳給客戶端"""
+    async with engine.connect() as conn:
+        result = await conn.execute(text("SELECT pg_current_wal_lsn()::text"))
+        return result.scalar()
+
+async def get_read_db(x_read_token: Optional[str] = Header(None, alias="x-read-token")):
+    """唯讀查詢用的 session：副本可用時走副本，否則走主庫"""
+    session_factory = ReplicaSessionLocal if await replica_router.use_replica(x_read_token) else AsyncSessionLocal
+    async with session_factory() as session:
+        yield session
@@ -2,7 +2,10 @@ from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
-engine = create_async_engine(settings.database_url, echo=True, future=True)
+engine = create_async_engine(
+    settings.database_url, echo=True, future=True,
+    pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow,
+)
 AsyncSessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
@@ -11,6 +14,22 @@ AsyncSessionLocal = sessionmaker(
     autocommit=False,
 )
 
+# Optional read replica for read-only endpoints
+replica_engine = (
+    create_async_engine(
+        settings.replica_database_url, echo=True, future=True,
+        pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow,
+    )
+    if settings.replica_database_url else None
+)
+ReplicaSessionLocal = sessionmaker(
+    bind=replica_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autoflush=False,
+    autocommit=False,
+) if replica_engine is not None else None
+
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
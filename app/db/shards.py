@@ -0,0 +1,50 @@
+from typing import Dict, List
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from app.core.config import settings
+from app.db.session import engine, AsyncSessionLocal
+
+# 主庫本身就是 default shard，merchants / merchant_api_keys / merchant_shards 只存在這裡
+DEFAULT_SHARD = "default"
+
+class ShardRegistry:
+    """管理每個 shard 的 engine 與 session factory，非預設 shard 在第一次使用時才建立連線池"""
+
+    def __init__(self, urls: Dict[str, str]):
+        self._urls = {DEFAULT_SHARD: settings.database_url, **urls}
+        self._engines: Dict[str, AsyncEngine] = {DEFAULT_SHARD: engine}
+        self._sessionmakers = {DEFAULT_SHARD: AsyncSessionLocal}
+
+    def names(self) -> List[str]:
+        return list(self._urls)
+
+    def url(self, name: str) -> str:
+        return self._urls[name]
+
+    def get_engine(self, name: str) -> AsyncEngine:
+        if name not in self._urls:
+            raise KeyError(f"Unknown shard: {name}")
+        if name not in self._engines:
+            self._engines[name] = create_async_engine(
+                self._urls[name], echo=True, future=True,
+                pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow,
+            )
+        return self._engines[name]
+
+    def session(self, name: str) -> AsyncSession:
+        if name not in self._sessionmakers:
+            self._sessionmakers[name] = sessionmaker(
+                bind=self.get_engine(name),
+                class_=AsyncSession,
+                expire_on_commit=False,
+                autoflush=False,
+                autocommit=False,
+            )
+        return self._sessionmakers[name]()
+
+    async def dispose(self):
+        for name, shard_engine in self._engines.items():
+            if name != DEFAULT_SHARD:
+                await shard_engine.dispose()
+
+shard_registry = ShardRegistry(settings.shard_database_urls)
@@ -2,8 +2,16 @@ from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from app.api.merchants import router as merchants_router
 from app.api.points import router as points_router
-from app.db.session import engine
+from app.api.metrics import router as metrics_router
+from app.db.session import engine, AsyncSessionLocal
+from app.db.shards import shard_registry
+from app.services.shard_service import list_merchant_shards
+from app.services.outbox_dispatcher import OutboxDispatcher
+from app.core.config import settings
+from app.core.invalidation import invalidation_bus
+from app.db.replica import replica_router, current_read_token
 from app.db.base import MerchantBase
+from app.core.multi_tenancy import ensure_tenant_tables
 from app.utils.logger import app_logger, logger
 import asyncio
 import traceback
@@ -39,23 +47,65 @@ async def unify_response(request: Request, call_next):
             data = json.loads(body)
         except Exception:
             return response
+        # Keep headers such as Retry-After, JSONResponse sets its own body headers
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-length", "content-type")}
         # Already unified
         if isinstance(data, dict) and set(data.keys()) >= {"code", "message", "data"}:
-            return JSONResponse(content=data, status_code=response.status_code)
+            return JSONResponse(content=data, status_code=response.status_code, headers=headers)
         return JSONResponse(
             content={"code": 0, "message": "success", "data": data},
             status_code=response.status_code,
+            headers=headers,
         )
     return response
 
+@app.middleware("http")
+async def attach_read_token(request: Request, call_next):
+    # 寫入成功後回傳主庫 WAL 位置，客戶端帶回 x-read-token 即可讀到自己的寫入
+    response = await call_next(request)
+    if (
+        replica_router.enabled
+        and request.method not in ("GET", "HEAD", "OPTIONS")
+        and request.url.path.startswith("/api/")
+        and response.status_code < 400
+    ):
+        try:
+            response.headers["x-read-token"] = await current_read_token()
+        except Exception as e:
+            app_logger.warning(f"Failed to get read token: {type(e).__name__}: {str(e)}")
+    return response
+
 @app.on_event("startup")
 async def on_startup():
     # Create tables for public schema (merchants, merchant_api_keys)
     async with engine.begin() as conn:
         await conn.run_sync(MerchantBase.metadata.create_all)
+    # Create tenant tables added after existing merchants were registered
+    async with AsyncSessionLocal() as db:
+        merchant_shards = await list_merchant_shards(db)
+    for merchant_id, shard in merchant_shards:
+        async with shard_registry.get_engine(shard).begin() as conn:
+            await ensure_tenant_tables(conn, f"merchant_{merchant_id}")
+
+    if settings.cache_invalidation_enabled:
+        await invalidation_bus.start([shard_registry.url(name) for name in shard_registry.names()])
+    if settings.outbox_dispatcher_in_app:
+        app.state.outbox_stop = asyncio.Event()
+        app.state.outbox_dispatcher = OutboxDispatcher()
+        app.state.outbox_task = asyncio.create_task(app.state.outbox_dispatcher.run(app.state.outbox_stop))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if settings.outbox_dispatcher_in_app:
+        app.state.outbox_stop.set()
+        await app.state.outbox_task
+        await app.state.outbox_dispatcher.close()
+    await invalidation_bus.stop()
+    await shard_registry.dispose()
 
 app.include_router(merchants_router)
 app.include_router(points_router)
+app.include_router(metrics_router)
 
 @app.get("/api/v1/ping")
 def ping():
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.dialects.postgresql import JSONB
+from app.models.base import TenantBase
+from app.utils.timezone import timezone_manager
+
+class LedgerImport(TenantBase):
+    """歷史流水匯入的進度，每個 chunk 與資料在同一個 DB 交易中更新，可由 offset 續傳"""
+    __tablename__ = "ledger_imports"
+    id = Column(Integer, primary_key=True, index=True)
+    import_key = Column(String, unique=True, nullable=False)
+    # 已處理的來源筆數（不含標題列）
+    offset = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default="running")
+    # 匯入期間暫時移除的索引定義，完成後重建
+    deferred_indexes = Column(JSONB, nullable=True)
+    created_at = Column(DateTime, default=lambda: timezone_manager.now().replace(tzinfo=None))
+    updated_at = Column(DateTime, default=lambda: timezone_manager.now().replace(tzinfo=None))
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
+from app.models.base import TenantBase
+from app.utils.timezone import timezone_manager
+
+class MemberBalance(TenantBase):
+    """每個 uid+point_rule_id 的最新餘額，隨流水寫入同步更新，供排行榜查詢"""
+    __tablename__ = "member_balances"
+    uid = Column(String, primary_key=True)
+    point_rule_id = Column(Integer, ForeignKey("point_rules.id"), primary_key=True)
+    balance = Column(Float, nullable=False)
+    updated_at = Column(DateTime, default=lambda: timezone_manager.now().replace(tzinfo=None))
+
+# 排行榜索引：同一規則內依餘額由高到低，top-N 與名次查詢皆走此索引
+Index(
+    "ix_member_balances_rank",
+    MemberBalance.point_rule_id,
+    MemberBalance.balance.desc(),
+    MemberBalance.uid,
+)
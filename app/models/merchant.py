@@ -19,3 +19,12 @@ class MerchantApiKey(Base):
     scope = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=lambda: timezone_manager.now().replace(tzinfo=None))
+
+class MerchantShard(Base):
+    """商戶所在的 shard；沒有資料的商戶視為在 default shard"""
+    __tablename__ = "merchant_shards"
+    merchant_id = Column(Integer, ForeignKey("merchants.id"), primary_key=True)
+    shard = Column(String, nullable=False, index=True)
+    # active：正常服務；moving：搬移中，暫停租戶 API
+    status = Column(String, nullable=False, default="active")
+    updated_at = Column(DateTime, default=lambda: timezone_manager.now().replace(tzinfo=None))
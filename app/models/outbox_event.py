@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
+from app.models.base import TenantBase
+from app.utils.timezone import timezone_manager
+
+class OutboxEvent(TenantBase):
+    """待送出的事件，與產生它的流水在同一個 DB 交易寫入，由 outbox dispatcher 投遞到 webhook"""
+    __tablename__ = "outbox_events"
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    # pending：待投遞；delivered：已送達；dead：超過重試次數
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=lambda: timezone_manager.now().replace(tzinfo=None))
+    last_error = Column(String, nullable=True)
+    delivered_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=lambda: timezone_manager.now().replace(tzinfo=None))
+
+    __table_args__ = (
+        Index("ix_outbox_events_pending", "next_attempt_at", "id", postgresql_where=text("status = 'pending'")),
+    )
@@ -6,8 +6,8 @@ from app.utils.timezone import timezone_manager
 class Transaction(TenantBase):
     __tablename__ = "transactions"
     id = Column(Integer, primary_key=True, index=True)
-    uid = Column(String, nullable=False, index=True)
-    point_rule_id = Column(Integer, ForeignKey("point_rules.id"), nullable=False, index=True)
+    uid = Column(String, nullable=False)
+    point_rule_id = Column(Integer, ForeignKey("point_rules.id"), nullable=False)
     amount = Column(Float, nullable=False)
     balance = Column(Float, nullable=False)
     detail = Column(JSONB, nullable=True)
@@ -15,4 +15,8 @@ class Transaction(TenantBase):
 
     __table_args__ = (
         Index("ix_transactions_detail_gin", "detail", postgresql_using="gin"),
+        # 流水查詢的篩選與 keyset 分頁（依 id 由新到舊）
+        Index("ix_transactions_uid_id", "uid", "id"),
+        Index("ix_transactions_point_rule_id_id", "point_rule_id", "id"),
+        Index("ix_transactions_created_at", "created_at"),
     )
@@ -0,0 +1,14 @@
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+
+class TransferLeg(BaseModel):
+    uid: str
+    point_rule_id: int
+    amount: float
+    detail: Optional[dict] = None
+
+
+class TransferRequest(BaseModel):
+    legs: List[TransferLeg] = Field(..., min_length=1, max_length=100, description="同一筆 DB 交易中依序套用的點數異動，最多 100 筆")
+    detail: Optional[dict] = Field(default=None, description="寫入每筆流水 detail 的共用內容")
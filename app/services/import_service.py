@@ -0,0 +1,264 @@
+import asyncio
+import csv
+import json
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from app.services.transaction_service import advisory_lock_key
+from app.utils.logger import logger
+from app.utils.timezone import timezone_manager
+
+COPY_COLUMNS = ["uid", "point_rule_id", "amount", "balance", "detail", "created_at"]
+
+
+class LedgerImportError(Exception):
+    """來源資料格式錯誤或匯入無法進行"""
+
+
+def iter_ledger_records(stream: TextIO, fmt: str) -> Iterator[dict]:
+    """
+    逐筆讀取 CSV（需有標題列）或 NDJSON
+
+    欄位：uid、point_rule_id、amount，可選 detail（JSON）、created_at（ISO 8601）
+    """
+    if fmt not in ("csv", "ndjson"):
+        raise LedgerImportError(f"Unsupported format: {fmt}")
+    # 解碼與格式錯誤一律轉為 LedgerImportError，並標示出錯的筆數
+    line_no = 0
+    try:
+        if fmt == "csv":
+            for record in csv.DictReader(stream):
+                line_no += 1
+                yield record
+        else:
+            for line in stream:
+                if line.strip():
+                    record = json.loads(line)
+                    line_no += 1
+                    yield record
+    except (UnicodeDecodeError, csv.Error, ValueError) as e:
+        raise LedgerImportError(f"Invalid record #{line_no + 1}: {type(e).__name__}: {e}")
+
+
+def _parse_record(record: dict, line_no: int, rule_ids: set) -> Tuple[str, int, float, str, datetime]:
+    try:
+        uid = str(record["uid"])
+        point_rule_id = int(record["point_rule_id"])
+        amount = float(record["amount"])
+        detail = record.get("detail") or {}
+        if isinstance(detail, str):
+            detail = json.loads(detail)
+        created_at = record.get("created_at")
+        if created_at:
+            created_at = timezone_manager.localize(datetime.fromisoformat(str(created_at)))
+        else:
+            created_at = timezone_manager.now()
+    except (KeyError, TypeError, ValueError) as e:
+        raise LedgerImportError(f"Invalid record #{line_no}: {type(e).__name__}: {e}")
+    if point_rule_id not in rule_ids:
+        raise LedgerImportError(f"Invalid record #{line_no}: point rule {point_rule_id} not found")
+    return uid, point_rule_id, amount, json.dumps(detail, ensure_ascii=False), created_at.replace(tzinfo=None)
+
+
+def _next_chunk(iterator: Iterator[dict], offset: int, chunk_size: int, max_keys: int, rule_ids: set) -> List[tuple]:
+    """讀取下一批資料，筆數不超過 chunk_size，且不同 uid+point_rule_id 不超過 max_keys 組"""
+    parsed, keys = [], set()
+    for record in iterator:
+        row = _parse_record(record, offset + len(parsed) + 1, rule_ids)
+        parsed.append(row)
+        keys.add(row[:2])
+        if len(parsed) >= chunk_size or len(keys) >= max_keys:
+            break
+    return parsed
+
+
+async def _lock_and_load_balances(conn, keys: List[Tuple[str, int]]) -> Dict[Tuple[str, int], float]:
+    """以與線上寫入相同的鎖與順序鎖定本 chunk 的會員，並讀取目前餘額"""
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(k) FROM unnest(CAST(:keys AS bigint[])) AS k ORDER BY k"),
+        {"keys": sorted({advisory_lock_key(uid, rule_id) for uid, rule_id in keys})}
+    )
+    result = await conn.execute(
+        text("""
+            SELECT b.uid, b.point_rule_id, b.balance
+            FROM member_balances b
+            JOIN unnest(CAST(:uids AS text[]), CAST(:rule_ids AS integer[])) AS k(uid, point_rule_id)
+              ON b.uid = k.uid AND b.point_rule_id = k.point_rule_id
+        """),
+        {"uids": [k[0] for k in keys], "rule_ids": [k[1] for k in keys]}
+    )
+    return {(uid, rule_id): balance for uid, rule_id, balance in result.all()}
+
+
+async def _defer_indexes(conn, schema_name: str) -> List[str]:
+    """移除 transactions 的次要索引並回傳定義，主鍵保留"""
+    result = await conn.execute(
+        text("""
+            SELECT i.indexname, i.indexdef
+            FROM pg_indexes i
+            JOIN pg_class c ON c.relname = i.indexname
+            JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = i.schemaname
+            JOIN pg_index x ON x.indexrelid = c.oid
+            WHERE i.schemaname = :schema AND i.tablename = 'transactions' AND NOT x.indisprimary
+        """),
+        {"schema": schema_name}
+    )
+    rows = result.all()
+    for index_name, _ in rows:
+        await conn.execute(text(f'DROP INDEX IF EXISTS "{schema_name}"."{index_name}"'))
+    return [index_def for _, index_def in rows]
+
+
+async def _restore_indexes(conn, index_defs: List[str]):
+    for index_def in index_defs:
+        await conn.execute(text(index_def.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1)))
+
+
+async def import_ledger(
+    engine: AsyncEngine,
+    schema_name: str,
+    records: Iterable[dict],
+    import_key: str,
+    chunk_size: int = 10000,
+    defer_indexes: Optional[bool] = None,
+    max_locks_per_chunk: int = 1000,
+) -> dict:
+    """
+    以 COPY 將歷史流水批次匯入租戶的 transactions
+
+    - 每個 chunk 依 (uid, point_rule_id) 接續計算 balance，並同步更新 member_balances
+    - 每個 chunk 對其中的會員持有與線上寫入相同的 advisory lock 直到 commit；Postgres 的 lock table
+      約只有 max_locks_per_transaction × max_connections 個名額，因此不同會員超過 max_locks_per_chunk 組時提前切出新的 chunk
+    - 資料與 ledger_imports.offset 在同一個 DB 交易 commit，中斷後以相同 import_key 重跑會從 offset 續傳
+    - defer_indexes 時先移除次要索引，全部完成後再重建；未指定時只在 transactions 為空（商戶尚未開始寫入）時移除，
+      避免線上寫入在沒有索引的情況下持鎖掃描整張表
+    - CSV / JSON 解析在 thread 中進行，不阻塞 event loop 上的其他請求
+    """
+    started = time.perf_counter()
+    loaded = 0
+    import_id = None
+    index_defs = None
+
+    async with engine.connect() as conn:
+        await conn.execute(text(f'SET search_path TO "{schema_name}", public'))
+        # 同一租戶同時只允許一個匯入
+        import_lock = advisory_lock_key(f"ledger_import:{schema_name}", 0)
+        result = await conn.execute(text("SELECT pg_try_advisory_lock(:lock_id)"), {"lock_id": import_lock})
+        if not result.scalar():
+            raise LedgerImportError("Another import is running for this merchant")
+        try:
+            result = await conn.execute(
+                text("SELECT id, \"offset\", status, deferred_indexes FROM ledger_imports WHERE import_key = :key"),
+                {"key": import_key}
+            )
+            checkpoint = result.first()
+            if checkpoint is None:
+                result = await conn.execute(
+                    text("""
+                        INSERT INTO ledger_imports (import_key, "offset", status, created_at, updated_at)
+                        VALUES (:key, 0, 'running', :now, :now) RETURNING id, "offset", status, deferred_indexes
+                    """),
+                    {"key": import_key, "now": timezone_manager.now().replace(tzinfo=None)}
+                )
+                checkpoint = result.first()
+            import_id, offset, status, index_defs = checkpoint
+            if status == "done":
+                await conn.commit()
+                return {"import_key": import_key, "rows": 0, "offset": offset, "elapsed": 0.0, "rows_per_sec": 0.0, "status": status}
+
+            if defer_indexes is None:
+                result = await conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM transactions)"))
+                defer_indexes = bool(result.scalar())
+            # 上次中斷時已移除的索引定義保存在 checkpoint 中
+            if defer_indexes and not index_defs:
+                index_defs = await _defer_indexes(conn, schema_name)
+                await conn.execute(
+                    text("UPDATE ledger_imports SET deferred_indexes = CAST(:defs AS jsonb) WHERE id = :id"),
+                    {"defs": json.dumps(index_defs), "id": import_id}
+                )
+            result = await conn.execute(text("SELECT id FROM point_rules"))
+            rule_ids = set(result.scalars().all())
+            await conn.commit()
+
+            raw = await conn.get_raw_connection()
+            driver_conn = raw.driver_connection
+            iterator = islice(iter(records), offset, None)
+            if offset:
+                logger(f"匯入續傳: Schema={schema_name}, Key={import_key}, Offset={offset}")
+
+            while True:
+                parsed = await asyncio.to_thread(_next_chunk, iterator, offset, chunk_size, max_locks_per_chunk, rule_ids)
+                if not parsed:
+                    break
+                keys = list({(uid, rule_id) for uid, rule_id, *_ in parsed})
+                balances = await _lock_and_load_balances(conn, keys)
+
+                rows = []
+                for uid, rule_id, amount, detail, created_at in parsed:
+                    balance = balances.get((uid, rule_id), 0.0) + amount
+                    balances[(uid, rule_id)] = balance
+                    rows.append((uid, rule_id, amount, balance, detail, created_at))
+
+                await driver_conn.copy_records_to_table(
+                    "transactions", records=rows, columns=COPY_COLUMNS, schema_name=schema_name
+                )
+                now = timezone_manager.now().replace(tzinfo=None)
+                await conn.execute(
+                    text("""
+                        INSERT INTO member_balances (uid, point_rule_id, balance, updated_at)
+                        VALUES (:uid, :point_rule_id, :balance, :updated_at)
+                        ON CONFLICT (uid, point_rule_id)
+                        DO UPDATE SET balance = EXCLUDED.balance, updated_at = EXCLUDED.updated_at
+                    """),
+                    [
+                        {"uid": uid, "point_rule_id": rule_id, "balance": balance, "updated_at": now}
+                        for (uid, rule_id), balance in balances.items()
+                    ]
+                )
+                offset += len(parsed)
+                await conn.execute(
+                    text("UPDATE ledger_imports SET \"offset\" = :offset, updated_at = :now WHERE id = :id"),
+                    {"offset": offset, "now": now, "id": import_id}
+                )
+                await conn.commit()
+
+                loaded += len(parsed)
+                elapsed = time.perf_counter() - started
+                logger(f"匯入進度: Schema={schema_name}, Key={import_key}, Offset={offset}, {loaded / elapsed:.0f} rows/s")
+
+            if index_defs:
+                await _restore_indexes(conn, index_defs)
+            await conn.execute(
+                text("UPDATE ledger_imports SET status = 'done', deferred_indexes = NULL, updated_at = :now WHERE id = :id"),
+                {"now": timezone_manager.now().replace(tzinfo=None), "id": import_id}
+            )
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            # 失敗時先把索引建回來，避免租戶在修正資料前都沒有索引可用；續傳時會再移除
+            if index_defs:
+                await _restore_indexes(conn, index_defs)
+                await conn.execute(
+                    text("UPDATE ledger_imports SET deferred_indexes = NULL WHERE id = :id"), {"id": import_id}
+                )
+                await conn.commit()
+            raise
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": import_lock})
+            await conn.execute(text("SET search_path TO public"))
+            await conn.commit()
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "import_key": import_key,
+        "rows": loaded,
+        "offset": offset,
+        "elapsed": round(elapsed, 3),
+        "rows_per_sec": round(loaded / elapsed, 1) if elapsed else 0.0,
+        "status": "done",
+    }
+    logger(f"匯入完成: Schema={schema_name}, {stats}")
+    return stats
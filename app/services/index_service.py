@@ -0,0 +1,91 @@
+import re
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+from app.core.multi_tenancy import TenantBase
+from app.db.shards import shard_registry
+from app.services.shard_service import list_tenant_schemas
+from app.services.transaction_service import advisory_lock_key
+from app.utils.logger import logger
+
+# 已被複合索引取代的舊索引：{舊索引: 取代它的索引}，取代的索引建好後才移除
+OBSOLETE_INDEXES = {
+    "ix_transactions_uid": "ix_transactions_uid_id",
+    "ix_transactions_point_rule_id": "ix_transactions_point_rule_id_id",
+}
+
+
+async def _index_validity(conn, schema_name: str) -> Dict[str, bool]:
+    result = await conn.execute(
+        text("""
+            SELECT c.relname, x.indisvalid
+            FROM pg_index x
+            JOIN pg_class c ON c.oid = x.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema
+        """),
+        {"schema": schema_name}
+    )
+    return dict(result.all())
+
+
+def _concurrent_ddl(index, dialect) -> str:
+    ddl = str(CreateIndex(index).compile(dialect=dialect))
+    return re.sub(r"^CREATE (UNIQUE )?INDEX ", r"CREATE \1INDEX CONCURRENTLY IF NOT EXISTS ", ddl, count=1)
+
+
+async def sync_tenant_indexes(engine, schema_name: str) -> Optional[dict]:
+    """
+    以 CREATE INDEX CONCURRENTLY 為一個租戶補建模型中新增的索引，並移除已被取代的舊索引
+
+    - 在交易外（AUTOCOMMIT）執行，建索引期間不阻擋寫入
+    - 先前中斷留下的 INVALID 索引會先移除再重建
+    - 同一租戶同時只會有一個程序在處理（session 層級 advisory lock），另一個程序會略過並回傳 None
+    回傳 {"created": [...], "dropped": [...]}
+    """
+    lock_key = advisory_lock_key(f"build_indexes:{schema_name}", 0)
+    created: List[str] = []
+    dropped: List[str] = []
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        result = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": lock_key})
+        if not result.scalar():
+            logger(f"索引補建略過: Schema={schema_name}，其他程序處理中", "WARNING")
+            return None
+        try:
+            # CREATE INDEX 的表名不帶 schema，以 session 層級 search_path 指定租戶
+            await conn.execute(text(f'SET search_path TO "{schema_name}", public'))
+            validity = await _index_validity(conn, schema_name)
+            for table in TenantBase.metadata.sorted_tables:
+                for index in table.indexes:
+                    if validity.get(index.name):
+                        continue
+                    if index.name in validity:
+                        await conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{schema_name}"."{index.name}"'))
+                    await conn.execute(text(_concurrent_ddl(index, conn.dialect)))
+                    created.append(index.name)
+                    logger(f"索引補建: Schema={schema_name}, Index={index.name}")
+
+            validity = await _index_validity(conn, schema_name)
+            for old_name, replacement in OBSOLETE_INDEXES.items():
+                if old_name in validity and validity.get(replacement):
+                    await conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{schema_name}"."{old_name}"'))
+                    dropped.append(old_name)
+                    logger(f"移除舊索引: Schema={schema_name}, Index={old_name}")
+        finally:
+            await conn.execute(text("RESET search_path"))
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": lock_key})
+    return {"created": created, "dropped": dropped}
+
+
+async def sync_all_tenant_indexes(merchant_ids: Optional[List[int]] = None) -> Dict[str, dict]:
+    """依序處理所有 shard 上的租戶 schema（一次只建一個索引，避免同時佔用過多 I/O）"""
+    report = {}
+    for shard in shard_registry.names():
+        engine = shard_registry.get_engine(shard)
+        for schema_name in await list_tenant_schemas(engine):
+            if merchant_ids is not None and int(schema_name.split("_", 1)[1]) not in merchant_ids:
+                continue
+            result = await sync_tenant_indexes(engine, schema_name)
+            report[schema_name] = {"shard": shard, "skipped": result is None, **(result or {})}
+    return report
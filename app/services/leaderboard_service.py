@@ -0,0 +1,92 @@
+from typing import List, Optional
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.member_balance import MemberBalance
+from app.utils.cache import TTLCache
+from app.utils.timezone import timezone_manager
+
+# 熱門活動頁面的短效快取，key 內含 schema 避免跨租戶誤用
+leaderboard_cache = TTLCache(ttl=settings.leaderboard_cache_ttl)
+
+
+async def upsert_member_balance(db: AsyncSession, uid: str, point_rule_id: int, balance: float):
+    """
+    同步更新排行榜使用的最新餘額。
+
+    需在寫入流水的同一個 DB 交易中、持有 uid+point_rule_id 的鎖時呼叫。
+    """
+    stmt = pg_insert(MemberBalance).values(
+        uid=uid,
+        point_rule_id=point_rule_id,
+        balance=balance,
+        updated_at=timezone_manager.now().replace(tzinfo=None),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MemberBalance.uid, MemberBalance.point_rule_id],
+        set_={"balance": stmt.excluded.balance, "updated_at": stmt.excluded.updated_at},
+    )
+    await db.execute(stmt)
+
+
+async def rebuild_member_balances(conn):
+    """依 transactions 的每個 uid+point_rule_id 最新一筆重建 member_balances（目前 search_path 的租戶）"""
+    await conn.execute(text("""
+        INSERT INTO member_balances (uid, point_rule_id, balance, updated_at)
+        SELECT DISTINCT ON (uid, point_rule_id) uid, point_rule_id, balance, created_at
+        FROM transactions
+        ORDER BY uid, point_rule_id, id DESC
+        ON CONFLICT (uid, point_rule_id)
+        DO UPDATE SET balance = EXCLUDED.balance, updated_at = EXCLUDED.updated_at
+    """))
+
+
+async def get_top_members(db: AsyncSession, schema_name: str, point_rule_id: int, limit: int) -> List[dict]:
+    cache_key = (schema_name, "top", point_rule_id, limit)
+    cached = leaderboard_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = await db.execute(
+        select(MemberBalance.uid, MemberBalance.balance)
+        .where(MemberBalance.point_rule_id == point_rule_id)
+        .order_by(MemberBalance.balance.desc(), MemberBalance.uid)
+        .limit(limit)
+    )
+    # 同分同名次（1, 2, 2, 4）
+    rows = []
+    for position, (uid, balance) in enumerate(result.all(), start=1):
+        rank = rows[-1]["rank"] if rows and rows[-1]["balance"] == balance else position
+        rows.append({"rank": rank, "uid": uid, "balance": balance})
+
+    leaderboard_cache.set(cache_key, rows)
+    return rows
+
+
+async def get_member_rank(db: AsyncSession, schema_name: str, point_rule_id: int, uid: str) -> Optional[dict]:
+    cache_key = (schema_name, "rank", point_rule_id, uid)
+    cached = leaderboard_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = await db.execute(
+        select(MemberBalance.balance)
+        .where(MemberBalance.point_rule_id == point_rule_id)
+        .where(MemberBalance.uid == uid)
+    )
+    balance = result.scalar_one_or_none()
+    if balance is None:
+        return None
+
+    # 名次 = 餘額比自己高的人數 + 1，只掃描排行榜索引中排在前面的範圍
+    higher = await db.execute(
+        select(func.count())
+        .select_from(MemberBalance)
+        .where(MemberBalance.point_rule_id == point_rule_id)
+        .where(MemberBalance.balance > balance)
+    )
+    row = {"uid": uid, "balance": balance, "rank": higher.scalar_one() + 1}
+
+    leaderboard_cache.set(cache_key, row)
+    return row
@@ -0,0 +1,185 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import text
+from app.db.shards import shard_registry
+from app.services.shard_service import list_tenant_schemas
+from app.services.transaction_service import advisory_lock_key
+from app.utils.logger import logger
+from app.utils.timezone import timezone_manager
+
+# 找出 id 區間內 balance != 前一筆 balance + amount 的 uid+point_rule_id，每組只回傳第一筆
+# 區間內第一筆的前一筆 balance 需回頭查區間之前的資料
+_VERIFY_CHUNK_SQL = text("""
+    SELECT DISTINCT ON (uid, point_rule_id) uid, point_rule_id, id, prev_balance + amount AS expected, balance AS actual
+    FROM (
+        SELECT c.id, c.uid, c.point_rule_id, c.amount, c.balance,
+               COALESCE(c.prev_balance, (
+                   SELECT t.balance FROM transactions t
+                   WHERE t.uid = c.uid AND t.point_rule_id = c.point_rule_id AND t.id < :lo
+                   ORDER BY t.id DESC LIMIT 1
+               ), 0) AS prev_balance
+        FROM (
+            SELECT id, uid, point_rule_id, amount, balance,
+                   lag(balance) OVER (PARTITION BY uid, point_rule_id ORDER BY id) AS prev_balance
+            FROM transactions
+            WHERE id >= :lo AND id < :hi
+        ) c
+    ) s
+    WHERE abs(balance - (prev_balance + amount)) > :epsilon
+    ORDER BY uid, point_rule_id, id
+""")
+
+
+async def _verify_chunk(engine, schema_name: str, lo: int, hi: int, epsilon: float) -> List[dict]:
+    async with engine.begin() as conn:
+        await conn.execute(
+            text("SELECT set_config('search_path', :path, true)"), {"path": f'"{schema_name}", public'}
+        )
+        result = await conn.execute(_VERIFY_CHUNK_SQL, {"lo": lo, "hi": hi, "epsilon": epsilon})
+        return [dict(row) for row in result.mappings().all()]
+
+
+async def _id_range(engine, schema_name: str) -> Tuple[int, int]:
+    async with engine.connect() as conn:
+        result = await conn.execute(text(f'SELECT min(id), max(id) FROM "{schema_name}".transactions'))
+        lo, hi = result.first()
+        return lo or 0, hi or 0
+
+
+async def verify_ledgers(
+    merchant_ids: Optional[List[int]] = None,
+    workers: int = 4,
+    chunk_size: int = 100000,
+    epsilon: float = 1e-6,
+) -> Dict[str, dict]:
+    """
+    檢查所有（或指定）租戶的 balance 是否等於前一筆 balance + amount
+
+    各 schema 依 id 切成 chunk，所有 chunk 共用 workers 個並行名額；每個查詢都是短的唯讀交易，不會長時間持有鎖。
+    回傳 {schema: {"shard", "id_range", "divergences": [{uid, point_rule_id, id, expected, actual}]}}，
+    divergences 為每組 uid+point_rule_id 第一筆出錯的流水。
+    """
+    semaphore = asyncio.Semaphore(workers)
+    report: Dict[str, dict] = {}
+    tasks = []
+
+    async def run_chunk(engine, schema_name, lo, hi):
+        async with semaphore:
+            return schema_name, await _verify_chunk(engine, schema_name, lo, hi, epsilon)
+
+    for shard in shard_registry.names():
+        engine = shard_registry.get_engine(shard)
+        for schema_name in await list_tenant_schemas(engine):
+            if merchant_ids is not None and int(schema_name.split("_", 1)[1]) not in merchant_ids:
+                continue
+            lo, hi = await _id_range(engine, schema_name)
+            report[schema_name] = {"shard": shard, "id_range": [lo, hi], "divergences": []}
+            for start in range(lo, hi + 1, chunk_size):
+                tasks.append(run_chunk(engine, schema_name, start, start + chunk_size))
+
+    first: Dict[Tuple[str, str, int], dict] = {}
+    for schema_name, rows in await asyncio.gather(*tasks):
+        for row in rows:
+            key = (schema_name, row["uid"], row["point_rule_id"])
+            if key not in first or row["id"] < first[key]["id"]:
+                first[key] = row
+    for (schema_name, _, _), row in sorted(first.items(), key=lambda item: (item[0][0], item[1]["id"])):
+        report[schema_name]["divergences"].append(row)
+
+    for schema_name, item in report.items():
+        if item["divergences"]:
+            logger(f"帳本檢查發現不一致: Schema={schema_name}, 組數={len(item['divergences'])}", "WARNING")
+    return report
+
+
+async def repair_member_ledger(
+    engine,
+    schema_name: str,
+    uid: str,
+    point_rule_id: int,
+    from_id: int,
+    batch_size: int = 1000,
+) -> int:
+    """
+    從 from_id 起依序重算某會員的 balance，回傳更新筆數
+
+    每批在自己的交易中持有與線上寫入相同的 advisory lock，只阻擋該會員的寫入一小段時間；
+    修復期間新寫入的流水 id 較大，會在後面的批次一併修正。
+    """
+    lock_id = advisory_lock_key(uid, point_rule_id)
+    updated = 0
+    while True:
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("SELECT set_config('search_path', :path, true)"), {"path": f'"{schema_name}", public'}
+            )
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": lock_id})
+            result = await conn.execute(
+                text("""
+                    SELECT balance FROM transactions
+                    WHERE uid = :uid AND point_rule_id = :rule_id AND id < :from_id
+                    ORDER BY id DESC LIMIT 1
+                """),
+                {"uid": uid, "rule_id": point_rule_id, "from_id": from_id}
+            )
+            balance = result.scalar() or 0.0
+            result = await conn.execute(
+                text("""
+                    SELECT id, amount, balance FROM transactions
+                    WHERE uid = :uid AND point_rule_id = :rule_id AND id >= :from_id
+                    ORDER BY id LIMIT :limit
+                """),
+                {"uid": uid, "rule_id": point_rule_id, "from_id": from_id, "limit": batch_size}
+            )
+            rows = result.all()
+
+            # 與寫入時相同的累加順序，避免浮點誤差造成新的不一致
+            ids, balances = [], []
+            for tx_id, amount, old_balance in rows:
+                balance = balance + amount
+                if balance != old_balance:
+                    ids.append(tx_id)
+                    balances.append(balance)
+            if ids:
+                await conn.execute(
+                    text("""
+                        UPDATE transactions t SET balance = v.balance
+                        FROM unnest(CAST(:ids AS integer[]), CAST(:balances AS double precision[])) AS v(id, balance)
+                        WHERE t.id = v.id
+                    """),
+                    {"ids": ids, "balances": balances}
+                )
+                updated += len(ids)
+
+            if len(rows) < batch_size:
+                # 最後一批仍持有鎖，同步更新排行榜使用的最新餘額
+                if rows:
+                    await conn.execute(
+                        text("""
+                            UPDATE member_balances SET balance = :balance, updated_at = :now
+                            WHERE uid = :uid AND point_rule_id = :rule_id
+                        """),
+                        {"balance": balance, "now": timezone_manager.now().replace(tzinfo=None), "uid": uid, "rule_id": point_rule_id}
+                    )
+                return updated
+            from_id = rows[-1][0] + 1
+
+
+async def repair_ledgers(report: Dict[str, dict], workers: int = 4, batch_size: int = 1000) -> int:
+    """依 verify_ledgers 的結果修復所有不一致的會員，回傳更新筆數"""
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(shard, schema_name, row):
+        async with semaphore:
+            updated = await repair_member_ledger(
+                shard_registry.get_engine(shard), schema_name, row["uid"], row["point_rule_id"], row["id"], batch_size
+            )
+            logger(f"帳本修復: Schema={schema_name}, UID={row['uid']}, Rule={row['point_rule_id']}, From={row['id']}, 更新 {updated} 筆")
+            return updated
+
+    results = await asyncio.gather(*[
+        run(item["shard"], schema_name, row)
+        for schema_name, item in report.items()
+        for row in item["divergences"]
+    ])
+    return sum(results)
@@ -0,0 +1,188 @@
+import asyncio
+import random
+from datetime import timedelta
+from typing import List, Optional
+import httpx
+from sqlalchemy import text
+from app.core.config import settings
+from app.db.shards import shard_registry
+from app.services.shard_service import list_tenant_schemas
+from app.utils.logger import logger
+from app.utils.timezone import timezone_manager
+
+
+class OutboxDispatcher:
+    """
+    將各租戶 outbox_events 的事件投遞到設定的 webhook
+
+    - 以 FOR UPDATE SKIP LOCKED 批次領取事件並設定租約（outbox_lease_seconds），多個 worker / process 可同時執行而不重複領取
+    - 領取與記錄結果各是一個短交易，HTTP 投遞期間不佔用 DB 連線
+    - 所有 URL 都回 2xx 才算送達，否則以指數退避重試，超過 outbox_max_attempts 標記為 dead
+    - 至少送達一次（at-least-once），接收端請以 `x-event-id` 去重
+    """
+
+    def __init__(self, urls: Optional[List[str]] = None, batch_size: Optional[int] = None):
+        self.urls = urls if urls is not None else settings.outbox_webhook_urls
+        self.batch_size = batch_size or settings.outbox_batch_size
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 共用連線池，keep-alive 連線在多個 worker 之間重複使用
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=settings.outbox_http_timeout,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(settings.outbox_backoff_max, settings.outbox_backoff_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, merchant_id: int, event) -> Optional[str]:
+        """送出單一事件，成功回傳 None，失敗回傳錯誤訊息"""
+        event_id, event_type, payload, created_at = event
+        body = {
+            "id": f"{merchant_id}:{event_id}",
+            "type": event_type,
+            "merchant_id": merchant_id,
+            "data": payload,
+            "created_at": timezone_manager.format_datetime(created_at),
+        }
+        headers = {"x-event-id": body["id"], "x-event-type": event_type}
+        for url in self.urls:
+            try:
+                resp = await self.client.post(url, json=body, headers=headers)
+            except httpx.HTTPError as e:
+                return f"{url}: {type(e).__name__}: {e}"
+            if resp.status_code >= 300:
+                return f"{url}: HTTP {resp.status_code}"
+        return None
+
+    async def _claim(self, engine, schema_name: str):
+        """
+        以短交易領取一批到期事件並設定租約，commit 後即釋放列鎖與連線
+
+        租約期間把 next_attempt_at 延後到租約到期時間，其他 worker 不會領取；dispatcher 中途結束時，
+        事件在租約到期後自動回到可領取狀態
+        """
+        now = timezone_manager.now().replace(tzinfo=None)
+        lease_until = now + timedelta(seconds=settings.outbox_lease_seconds)
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("SELECT set_config('search_path', :path, true)"), {"path": f'"{schema_name}", public'}
+            )
+            result = await conn.execute(
+                text("""
+                    UPDATE outbox_events SET next_attempt_at = :lease_until
+                    WHERE id IN (
+                        SELECT id FROM outbox_events
+                        WHERE status = 'pending' AND next_attempt_at <= :now
+                        ORDER BY id
+                        LIMIT :limit
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, event_type, payload, created_at, attempts
+                """),
+                {"now": now, "lease_until": lease_until, "limit": self.batch_size}
+            )
+            events = sorted(result.all(), key=lambda event: event.id)
+        return events, lease_until
+
+    async def dispatch_schema(self, engine, schema_name: str) -> int:
+        """領取並投遞一個租戶的一批事件，回傳處理筆數"""
+        merchant_id = int(schema_name.split("_", 1)[1])
+        events, lease_until = await self._claim(engine, schema_name)
+        if not events:
+            return 0
+
+        # 投遞期間不持有 DB 連線與列鎖
+        errors = await asyncio.gather(*[self._deliver(merchant_id, event[:4]) for event in events])
+
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("SELECT set_config('search_path', :path, true)"), {"path": f'"{schema_name}", public'}
+            )
+            now = timezone_manager.now().replace(tzinfo=None)
+            # 只更新仍持有租約的事件；租約已過期的事件可能已被其他 worker 重新領取，交由對方記錄結果
+            lease = "status = 'pending' AND next_attempt_at = :lease_until"
+            delivered = [event.id for event, error in zip(events, errors) if error is None]
+            if delivered:
+                await conn.execute(
+                    text(f"UPDATE outbox_events SET status = 'delivered', delivered_at = :now, attempts = attempts + 1 WHERE id = ANY(:ids) AND {lease}"),
+                    {"now": now, "ids": delivered, "lease_until": lease_until}
+                )
+            for event, error in zip(events, errors):
+                if error is None:
+                    continue
+                attempts = event.attempts + 1
+                dead = attempts >= settings.outbox_max_attempts
+                await conn.execute(
+                    text(f"""
+                        UPDATE outbox_events
+                        SET attempts = :attempts, last_error = :error, status = :status, next_attempt_at = :next_attempt_at
+                        WHERE id = :id AND {lease}
+                    """),
+                    {
+                        "id": event.id,
+                        "attempts": attempts,
+                        "error": error[:1000],
+                        "status": "dead" if dead else "pending",
+                        "next_attempt_at": now + timedelta(seconds=self._backoff(attempts)),
+                        "lease_until": lease_until,
+                    }
+                )
+                logger(f"事件投遞失敗: Schema={schema_name}, Event={event.id}, Attempts={attempts}, {error}", "ERROR" if dead else "WARNING")
+        return len(events)
+
+    async def purge_delivered(self, engine, schema_name: str):
+        before = timezone_manager.now().replace(tzinfo=None) - timedelta(hours=settings.outbox_retention_hours)
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(f'DELETE FROM "{schema_name}".outbox_events WHERE status = \'delivered\' AND delivered_at < :before'),
+                {"before": before}
+            )
+
+    async def run_once(self) -> int:
+        """對所有 shard 的所有租戶各處理一批，回傳處理筆數"""
+        processed = 0
+        for shard in shard_registry.names():
+            engine = shard_registry.get_engine(shard)
+            for schema_name in await list_tenant_schemas(engine):
+                try:
+                    processed += await self.dispatch_schema(engine, schema_name)
+                except Exception as e:
+                    logger(f"事件投遞異常: Shard={shard}, Schema={schema_name}, {type(e).__name__}: {e}", "ERROR")
+        return processed
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        """持續投遞，沒有待送事件時等待 outbox_poll_interval 秒"""
+        if not self.urls:
+            logger("未設定 OUTBOX_WEBHOOK_URLS，outbox dispatcher 不啟動", "WARNING")
+            return
+        stop = stop or asyncio.Event()
+        last_purge = 0.0
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            processed = 0
+            try:
+                processed = await self.run_once()
+                if loop.time() - last_purge > 3600:
+                    last_purge = loop.time()
+                    for shard in shard_registry.names():
+                        engine = shard_registry.get_engine(shard)
+                        for schema_name in await list_tenant_schemas(engine):
+                            await self.purge_delivered(engine, schema_name)
+            except Exception as e:
+                logger(f"outbox dispatcher 異常: {type(e).__name__}: {e}", "ERROR")
+            if processed == 0:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=settings.outbox_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
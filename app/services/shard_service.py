@@ -0,0 +1,290 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.multi_tenancy import ensure_tenant_tables
+from app.core.invalidation import invalidation_bus, InvalidationEvent, MERCHANT
+from app.db.session import AsyncSessionLocal
+from app.db.shards import shard_registry, DEFAULT_SHARD
+from app.models.base import TenantBase
+from app.models.merchant import Merchant, MerchantShard
+from app.services.transaction_service import advisory_lock_key
+from app.utils.logger import logger
+from app.utils.timezone import timezone_manager
+
+
+async def choose_shard(db: AsyncSession) -> str:
+    """挑選目前商戶數最少的 shard 放置新租戶（同數量時依設定順序）"""
+    shard_name = func.coalesce(MerchantShard.shard, DEFAULT_SHARD)
+    result = await db.execute(
+        select(shard_name, func.count(Merchant.id))
+        .select_from(Merchant)
+        .outerjoin(MerchantShard, MerchantShard.merchant_id == Merchant.id)
+        .group_by(shard_name)
+    )
+    counts = dict(result.all())
+    return min(shard_registry.names(), key=lambda name: counts.get(name, 0))
+
+
+async def get_merchant_shard(db: AsyncSession, merchant_id: int) -> Tuple[str, str]:
+    """回傳 (shard, status)"""
+    result = await db.execute(select(MerchantShard).where(MerchantShard.merchant_id == merchant_id))
+    row = result.scalar_one_or_none()
+    if row is None:
+        return DEFAULT_SHARD, "active"
+    return row.shard, row.status
+
+
+async def set_merchant_shard(db: AsyncSession, merchant_id: int, shard: str, status: str = "active"):
+    """更新 shard directory，呼叫端負責 commit"""
+    result = await db.execute(select(MerchantShard).where(MerchantShard.merchant_id == merchant_id))
+    row = result.scalar_one_or_none()
+    if row is None:
+        row = MerchantShard(merchant_id=merchant_id)
+        db.add(row)
+    row.shard = shard
+    row.status = status
+    row.updated_at = timezone_manager.now().replace(tzinfo=None)
+
+
+async def list_merchant_shards(db: AsyncSession) -> List[Tuple[int, str]]:
+    """列出所有商戶與所在 shard"""
+    result = await db.execute(
+        select(Merchant.id, func.coalesce(MerchantShard.shard, DEFAULT_SHARD))
+        .outerjoin(MerchantShard, MerchantShard.merchant_id == Merchant.id)
+        .order_by(Merchant.id)
+    )
+    return [tuple(row) for row in result.all()]
+
+
+
+async def list_tenant_schemas(engine) -> List[str]:
+    """列出某個 shard 上的所有租戶 schema（不含搬移後保留的 merchant_<id>_moved_*）"""
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text(r"SELECT nspname FROM pg_namespace WHERE nspname ~ '^merchant_[0-9]+$' ORDER BY nspname")
+        )
+        return list(result.scalars().all())
+
+# 只會新增、不會更新的表：搬移時依 id 增量複製；其他表在凍結後整表 upsert
+APPEND_ONLY_TABLES = {"transactions"}
+
+
+async def _copy_table(source, target, table, batch_size: int, after_id: Optional[int] = None, upsert: bool = False) -> int:
+    """串流複製 source 的資料到 target，回傳複製筆數"""
+    query = select(table)
+    if after_id is not None:
+        query = query.where(table.c.id > after_id).order_by(table.c.id)
+    stmt = pg_insert(table)
+    if upsert:
+        pk_names = {c.name for c in table.primary_key.columns}
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={c.name: stmt.excluded[c.name] for c in table.columns if c.name not in pk_names},
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing()
+
+    copied = 0
+    result = await source.stream(query)
+    async for partition in result.mappings().partitions(batch_size):
+        await target.execute(stmt, [dict(row) for row in partition])
+        copied += len(partition)
+    return copied
+
+
+async def _max_id(conn, table) -> int:
+    result = await conn.execute(select(func.coalesce(func.max(table.c.id), 0)))
+    return result.scalar_one()
+
+
+async def _bucket_counts(conn, table, bucket_size: int) -> Dict[int, Tuple[int, int]]:
+    """依 id 區段統計 {區段: (筆數, id 總和)}，只掃主鍵索引"""
+    bucket = (table.c.id // bucket_size).label("bucket")
+    result = await conn.execute(
+        select(bucket, func.count(), func.coalesce(func.sum(table.c.id), 0)).group_by(bucket)
+    )
+    return {b: (count, id_sum) for b, count, id_sum in result.all()}
+
+
+async def _reconcile_table(source, target, table, batch_size: int, bucket_size: int = 100000) -> int:
+    """
+    補齊 target 缺少的 append-only 資料，回傳複製筆數
+
+    serial id 在 INSERT 時配發、COMMIT 時才可見，線上複製時較小的 id 可能晚於較大的 id 出現，
+    只從 target 最大 id 接續會永久漏掉這些資料；因此逐區段比對筆數與 id 總和，不一致的區段整段以 on conflict do nothing 重抄。
+    """
+    source_buckets = await _bucket_counts(source, table, bucket_size)
+    target_buckets = await _bucket_counts(target, table, bucket_size)
+    stmt = pg_insert(table).on_conflict_do_nothing()
+    copied = 0
+    for b, stats in sorted(source_buckets.items()):
+        if target_buckets.get(b) == stats:
+            continue
+        query = select(table).where(table.c.id >= b * bucket_size, table.c.id < (b + 1) * bucket_size)
+        result = await source.stream(query)
+        async for partition in result.mappings().partitions(batch_size):
+            await target.execute(stmt, [dict(row) for row in partition])
+            copied += len(partition)
+    return copied
+
+
+async def _table_checksum(conn, table) -> Tuple[int, int]:
+    result = await conn.execute(select(func.count(), func.coalesce(func.sum(table.c.id), 0)))
+    return tuple(result.one())
+
+
+async def _copy_tenant(source, target, schema_name: str, batch_size: int, final: bool):
+    """
+    複製整個租戶 schema，重跑不會重複寫入
+
+    append-only 表線上階段從 target 目前最大 id 之後接續；凍結後逐區段補齊缺漏，並確認兩邊筆數與 id 總和一致。
+    source / target 為已設定 search_path 的連線，交易由呼叫端控制。
+    """
+    for table in TenantBase.metadata.sorted_tables:
+        if table.name in APPEND_ONLY_TABLES and final:
+            copied = await _reconcile_table(source, target, table, batch_size)
+            source_sum, target_sum = await _table_checksum(source, table), await _table_checksum(target, table)
+            if source_sum != target_sum:
+                raise RuntimeError(
+                    f"{schema_name}.{table.name} mismatch after copy: source (count, id sum)={source_sum}, target={target_sum}"
+                )
+        elif table.name in APPEND_ONLY_TABLES:
+            after_id = await _max_id(target, table)
+            copied = await _copy_table(source, target, table, batch_size, after_id=after_id)
+        elif final or "id" in table.c:
+            # 有 id 的表（如 point_rules）需先複製，append-only 表的外鍵才找得到
+            copied = await _copy_table(source, target, table, batch_size, upsert=True)
+        else:
+            continue
+        logger(f"搬移租戶 {schema_name}: {table.name} 複製 {copied} 筆{'（凍結後）' if final else ''}")
+    if final:
+        # 對齊 serial sequence，讓新 shard 接續原本的 id
+        for table in TenantBase.metadata.sorted_tables:
+            if "id" in table.c:
+                await target.execute(
+                    text("SELECT setval(pg_get_serial_sequence(:table, 'id'), :next_id, false)"),
+                    {"table": f'"{schema_name}".{table.name}', "next_id": await _max_id(target, table) + 1}
+                )
+
+
+async def _set_local_search_path(conn, schema_name: str):
+    await conn.execute(text("SELECT set_config('search_path', :path, true)"), {"path": f'"{schema_name}", public'})
+
+
+async def _try_import_lock(conn, schema_name: str) -> bool:
+    """在目前交易內取得租戶的匯入鎖；匯入進行中（import_service 持有同一把 session 鎖）時回傳 False"""
+    result = await conn.execute(
+        text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": advisory_lock_key(f"ledger_import:{schema_name}", 0)}
+    )
+    return bool(result.scalar())
+
+
+async def _retire_source(conn, schema_name: str, drop_source: bool):
+    """
+    停用原 schema：刪除，或加上拒絕寫入的 trigger 後改名保留
+
+    在持有 LOCK TABLE 的交易內執行，排隊等鎖的寫入取得鎖後會因表已刪除或 trigger 而失敗，不會寫進舊 schema 後遺失。
+    """
+    if drop_source:
+        await conn.execute(text(f'DROP SCHEMA "{schema_name}" CASCADE'))
+        return
+    await conn.execute(text(f"""
+        CREATE FUNCTION "{schema_name}".reject_moved_writes() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            RAISE EXCEPTION 'tenant % has moved to another shard', TG_TABLE_SCHEMA USING ERRCODE = 'read_only_sql_transaction';
+        END
+        $$
+    """))
+    for table in TenantBase.metadata.sorted_tables:
+        await conn.execute(text(
+            f'CREATE TRIGGER reject_moved_writes BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{schema_name}".{table.name} '
+            f'FOR EACH STATEMENT EXECUTE FUNCTION "{schema_name}".reject_moved_writes()'
+        ))
+    moved_name = f"{schema_name}_moved_{timezone_manager.now().strftime('%Y%m%d%H%M%S')}"
+    await conn.execute(text(f'ALTER SCHEMA "{schema_name}" RENAME TO "{moved_name}"'))
+
+
+async def _set_directory(merchant_id: int, shard: str, status: str):
+    async with AsyncSessionLocal() as db:
+        await set_merchant_shard(db, merchant_id, shard, status)
+        await invalidation_bus.publish(db, InvalidationEvent(MERCHANT, merchant_id))
+        await db.commit()
+
+
+async def move_tenant(
+    merchant_id: int,
+    target_shard: str,
+    batch_size: int = 5000,
+    drain_seconds: Optional[float] = None,
+    drop_source: bool = False,
+):
+    """
+    線上搬移租戶 schema 到另一個 shard
+
+    1. 在目標 shard 建立 schema，租戶持續服務時先複製大部分資料
+    2. 將 directory 標記為 moving（租戶 API 回 503），等待進行中的請求結束
+    3. 在原 shard 的同一個交易內：確認沒有進行中的匯入、以 LOCK TABLE ... IN EXCLUSIVE MODE 擋下所有寫入，
+       補齊剩餘資料並比對筆數與 id 總和、對齊 sequence 後提交目標 shard，再將 directory 指向目標 shard
+    4. 仍在同一個交易內將原 schema 加上拒絕寫入的 trigger 後改名保留（或 drop_source=True 時刪除）
+
+    切換前失敗時恢復原 shard；匯入進行中時拒絕搬移（ValueError）。
+    """
+    if drain_seconds is None:
+        drain_seconds = settings.shard_move_drain_seconds
+    async with AsyncSessionLocal() as db:
+        source_shard, status = await get_merchant_shard(db, merchant_id)
+    if target_shard not in shard_registry.names():
+        raise ValueError(f"Unknown shard: {target_shard}")
+    if target_shard == source_shard:
+        raise ValueError(f"Merchant {merchant_id} is already on shard {target_shard}")
+    if status != "active":
+        raise ValueError(f"Merchant {merchant_id} is {status}")
+
+    schema_name = f"merchant_{merchant_id}"
+    source_engine = shard_registry.get_engine(source_shard)
+    target_engine = shard_registry.get_engine(target_shard)
+    async with source_engine.begin() as conn:
+        if not await _try_import_lock(conn, schema_name):
+            raise ValueError(f"Merchant {merchant_id} has a ledger import in progress")
+    logger(f"開始搬移租戶: Merchant={merchant_id}, {source_shard} -> {target_shard}")
+
+    async with target_engine.begin() as conn:
+        await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema_name}"'))
+        await ensure_tenant_tables(conn, schema_name)
+
+    async with source_engine.begin() as source, target_engine.begin() as target:
+        for conn in (source, target):
+            await _set_local_search_path(conn, schema_name)
+        await _copy_tenant(source, target, schema_name, batch_size, final=False)
+
+    await _set_directory(merchant_id, source_shard, "moving")
+    switched = False
+    try:
+        await asyncio.sleep(drain_seconds)
+        async with source_engine.begin() as source:
+            await _set_local_search_path(source, schema_name)
+            if not await _try_import_lock(source, schema_name):
+                raise ValueError(f"Merchant {merchant_id} has a ledger import in progress")
+            # 讀取仍可進行；寫入（包含 drain 後才抵達的請求與 outbox dispatcher）會等到交易結束
+            tables = ", ".join(table.name for table in TenantBase.metadata.sorted_tables)
+            await source.execute(text(f"LOCK TABLE {tables} IN EXCLUSIVE MODE"))
+            async with target_engine.begin() as target:
+                await _set_local_search_path(target, schema_name)
+                await _copy_tenant(source, target, schema_name, batch_size, final=True)
+            await _set_directory(merchant_id, target_shard, "active")
+            switched = True
+            await _retire_source(source, schema_name, drop_source)
+    except BaseException:
+        if switched:
+            logger(
+                f"搬移租戶已切換至 {target_shard}，但停用原 schema 失敗，請手動處理 {source_shard} 上的 {schema_name}: Merchant={merchant_id}",
+                "ERROR"
+            )
+        else:
+            await _set_directory(merchant_id, source_shard, "active")
+            logger(f"搬移租戶失敗，已恢復於原 shard: Merchant={merchant_id}, Shard={source_shard}", "ERROR")
+        raise
+    logger(f"搬移租戶完成: Merchant={merchant_id}, {source_shard} -> {target_shard}")
@@ -1,20 +1,63 @@
+import hashlib
+from typing import List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc, func, text
+from app.models.point_rule import PointRule
 from app.models.transaction import Transaction
+from app.models.outbox_event import OutboxEvent
+from app.core.config import settings
+from app.utils.timezone import timezone_manager
+from app.services.leaderboard_service import upsert_member_balance
 from sqlalchemy.exc import SQLAlchemyError
 
-async def insert_transaction_with_lock(
-    db: AsyncSession,
-    uid: str,
-    point_rule_id: int,
-    amount: float,
-    detail: dict = None
-):
-    # Acquire advisory lock based on uid+point_rule_id hash
-    lock_id = abs(hash(f"{uid}:{point_rule_id}")) % (2**63)
-    await db.execute(text(f"SELECT pg_advisory_xact_lock({lock_id})"))
 
-    # Get latest balance for this uid+point_rule_id
+class InsufficientBalanceError(Exception):
+    """多筆異動套用後，有 (uid, point_rule_id) 的餘額會變成負數"""
+
+    def __init__(self, uid: str, point_rule_id: int, balance: float, amount: float):
+        self.uid = uid
+        self.point_rule_id = point_rule_id
+        self.balance = balance
+        self.amount = amount
+        super().__init__(
+            f"Insufficient balance: uid={uid}, point_rule_id={point_rule_id}, balance={balance}, amount={amount}"
+        )
+
+
+class PointRuleNotFoundError(Exception):
+    """異動引用了不存在的點數規則"""
+
+    def __init__(self, point_rule_ids):
+        self.point_rule_ids = sorted(point_rule_ids)
+        super().__init__(f"Point rule not found: {self.point_rule_ids}")
+
+
+def advisory_lock_key(uid: str, point_rule_id: int) -> int:
+    """
+    將 uid+point_rule_id 映射為 pg_advisory_xact_lock 使用的 bigint。
+
+    不使用內建 hash()：它在每個 process 中帶有不同的隨機種子，
+    多個 uvicorn worker 會對同一會員算出不同的鎖，互相擋不住。
+    """
+    digest = hashlib.blake2b(f"{uid}:{point_rule_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+async def _acquire_locks(db: AsyncSession, keys: List[Tuple[str, int]]):
+    """
+    依標準順序（advisory lock key 由小到大）取得多個 (uid, point_rule_id) 的鎖。
+
+    所有同時持有多把鎖的交易都以相同順序加鎖，因此交叉轉點不會互相死結；
+    多把鎖在同一個查詢中依序取得，不必在持有前面的鎖時逐把來回。
+    """
+    lock_ids = sorted({advisory_lock_key(uid, point_rule_id) for uid, point_rule_id in keys})
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(k) FROM unnest(CAST(:keys AS bigint[])) AS k ORDER BY k"),
+        {"keys": lock_ids}
+    )
+
+
+async def _get_last_balance(db: AsyncSession, uid: str, point_rule_id: int) -> float:
     result = await db.execute(
         select(Transaction.balance)
         .where(Transaction.uid == uid)
@@ -25,17 +68,114 @@ async def insert_transaction_with_lock(
     last_balance = result.scalar_one_or_none()
     if last_balance is None:
         last_balance = 0.0
+    return last_balance
 
-    new_balance = last_balance + amount
 
+async def _append_transaction(
+    db: AsyncSession,
+    uid: str,
+    point_rule_id: int,
+    amount: float,
+    balance: float,
+    detail: dict = None
+) -> Transaction:
+    """在目前的 DB 交易中加入一筆流水；呼叫端需已持有對應的鎖並負責 commit"""
     tx = Transaction(
         uid=uid,
         point_rule_id=point_rule_id,
         amount=amount,
-        balance=new_balance,
+        balance=balance,
         detail=detail or {}
     )
     db.add(tx)
+    await upsert_member_balance(db, uid, point_rule_id, balance)
+    if settings.outbox_webhook_urls:
+        # flush 取得流水 id，事件與流水同一個 commit
+        await db.flush()
+        db.add(OutboxEvent(
+            event_type="balance.changed",
+            payload={
+                "transaction_id": tx.id,
+                "uid": uid,
+                "point_rule_id": point_rule_id,
+                "amount": amount,
+                "balance": balance,
+                "created_at": timezone_manager.format_datetime(tx.created_at),
+            },
+        ))
+    return tx
+
+
+async def insert_transaction_with_lock(
+    db: AsyncSession,
+    uid: str,
+    point_rule_id: int,
+    amount: float,
+    detail: dict = None
+):
+    # Acquire advisory lock based on uid+point_rule_id hash
+    await _acquire_locks(db, [(uid, point_rule_id)])
+
+    # Get latest balance for this uid+point_rule_id
+    last_balance = await _get_last_balance(db, uid, point_rule_id)
+
+    new_balance = last_balance + amount
+
+    tx = await _append_transaction(db, uid, point_rule_id, amount, new_balance, detail)
     await db.commit()
     await db.refresh(tx)
     return tx
+
+
+async def apply_transfer(
+    db: AsyncSession,
+    legs: List[dict],
+    detail: Optional[dict] = None
+) -> List[Transaction]:
+    """
+    在單一 DB 交易中套用多筆點數異動（會員間轉點、規則間兌換等）。
+
+    - 先依標準順序取得所有相關 (uid, point_rule_id) 的鎖
+    - 寫入前檢查每個被扣點的帳戶，套用全部異動後餘額不可小於 0
+    - 全部成功才 commit，任一檢查失敗則 rollback，不會留下半套的轉點
+
+    legs 每一項需包含 uid、point_rule_id、amount，可選 detail。
+    """
+    rule_ids = {leg["point_rule_id"] for leg in legs}
+    result = await db.execute(select(PointRule.id).where(PointRule.id.in_(rule_ids)))
+    missing = rule_ids - set(result.scalars().all())
+    if missing:
+        await db.rollback()
+        raise PointRuleNotFoundError(missing)
+
+    keys = [(leg["uid"], leg["point_rule_id"]) for leg in legs]
+    await _acquire_locks(db, keys)
+
+    balances = {}
+    for key in keys:
+        if key not in balances:
+            balances[key] = await _get_last_balance(db, *key)
+
+    # 先在記憶體中算出每筆異動後的餘額，確認不會透支再寫入
+    running = dict(balances)
+    planned = []
+    for leg in legs:
+        key = (leg["uid"], leg["point_rule_id"])
+        new_balance = running[key] + leg["amount"]
+        if leg["amount"] < 0 and new_balance < 0:
+            await db.rollback()
+            raise InsufficientBalanceError(key[0], key[1], running[key], leg["amount"])
+        running[key] = new_balance
+        planned.append((leg, new_balance))
+
+    txs = []
+    for leg, new_balance in planned:
+        leg_detail = dict(detail or {})
+        leg_detail.update(leg.get("detail") or {})
+        txs.append(await _append_transaction(
+            db, leg["uid"], leg["point_rule_id"], leg["amount"], new_balance, leg_detail
+        ))
+    # flush 取得 id/created_at，commit 後不再使用這個 session 查詢
+    await db.flush()
+    await db.commit()
+    return txs
@@ -0,0 +1,157 @@
+import asyncio
+import pytest
+from dotenv import load_dotenv
+load_dotenv(dotenv_path="app/.env")
+from fastapi import HTTPException
+import app.core.admission as admission
+from app.core.admission import AdmissionController, FairScheduler, TenantState, TokenBucket
+
+def _tenant(weight=1.0):
+    return TenantState(max_concurrent=0, rate=0, burst=0, weight=weight)
+
+@pytest.fixture
+def limits(monkeypatch):
+    def apply(**overrides):
+        values = dict(
+            tenant_max_concurrent=10, tenant_rate_per_sec=0, tenant_burst=0, tenant_weight=1,
+            tenant_limits={}, admission_pool_slots=10, admission_queue_timeout=5,
+        )
+        values.update(overrides)
+        for name, value in values.items():
+            monkeypatch.setattr(admission.settings, name, value)
+    apply()
+    return apply
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, burst=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5, abs=0.01)
+    assert TokenBucket(rate=0, burst=0).try_acquire() == 0
+
+@pytest.mark.asyncio
+async def test_rate_rejection_sets_retry_after(limits):
+    limits(tenant_rate_per_sec=0.5, tenant_burst=1)
+    controller = AdmissionController()
+    async with controller.admit(1, "default"):
+        pass
+    with pytest.raises(HTTPException) as exc:
+        async with controller.admit(1, "default"):
+            pass
+    assert exc.value.status_code == 429
+    assert exc.value.headers["Retry-After"] == "2"
+    # 其他租戶不受影響
+    async with controller.admit(2, "default"):
+        pass
+    assert controller.metrics()["tenants"][1]["rejected"]["rate"] == 1
+
+@pytest.mark.asyncio
+async def test_concurrency_rejection(limits):
+    limits(tenant_limits={"1": {"max_concurrent": 1}})
+    controller = AdmissionController()
+    async with controller.admit(1, "default"):
+        with pytest.raises(HTTPException) as exc:
+            async with controller.admit(1, "default"):
+                pass
+        assert exc.value.status_code == 429
+        async with controller.admit(2, "default"):
+            pass
+    async with controller.admit(1, "default"):
+        pass
+    assert controller.metrics()["tenants"][1]["rejected"]["concurrency"] == 1
+
+@pytest.mark.asyncio
+async def test_wfq_orders_by_weight():
+    scheduler = FairScheduler(capacity=1)
+    light, heavy = _tenant(weight=1), _tenant(weight=3)
+    await scheduler.acquire(light, timeout=1)
+    order = []
+
+    async def request(name, tenant):
+        await scheduler.acquire(tenant, timeout=5)
+        order.append(name)
+
+    # 輕量租戶先排入大量請求，權重 3 的租戶之後才排入仍能優先取得名額
+    tasks = [asyncio.create_task(request(f"light{i}", light)) for i in range(4)]
+    await asyncio.sleep(0)
+    tasks += [asyncio.create_task(request(f"heavy{i}", heavy)) for i in range(4)]
+    await asyncio.sleep(0)
+    assert scheduler.depth == 8
+    for _ in range(8):
+        scheduler.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    assert order == ["heavy0", "heavy1", "light0", "heavy2", "heavy3", "light1", "light2", "light3"]
+    scheduler.release()
+    assert scheduler.in_use == 0
+
+@pytest.mark.asyncio
+async def test_queue_timeout(limits):
+    limits(admission_pool_slots=1, admission_queue_timeout=0.05)
+    controller = AdmissionController()
+    async with controller.admit(1, "default"):
+        with pytest.raises(HTTPException) as exc:
+            async with controller.admit(2, "default"):
+                pass
+        assert exc.value.status_code == 429
+    metrics = controller.metrics()
+    assert metrics["tenants"][2]["rejected"]["queue_timeout"] == 1
+    assert metrics["shards"]["default"] == {"capacity": 1, "in_use": 0, "queue_depth": 0}
+
+@pytest.mark.asyncio
+async def test_queue_timeout_racing_with_grant(monkeypatch):
+    scheduler = FairScheduler(capacity=1)
+    tenant = _tenant()
+    await scheduler.acquire(tenant, timeout=1)
+    real_wait_for = asyncio.wait_for
+
+    async def grant_then_timeout(awaitable, timeout):
+        # 名額在逾時的同時交給排隊中的請求
+        scheduler.release()
+        awaitable.cancel()
+        raise asyncio.TimeoutError
+
+    monkeypatch.setattr(admission.asyncio, "wait_for", grant_then_timeout)
+    # 已取得名額時照常使用，不會遺失名額
+    await scheduler.acquire(tenant, timeout=0.01)
+    monkeypatch.setattr(admission.asyncio, "wait_for", real_wait_for)
+    assert scheduler.in_use == 1
+    assert tenant.queued == 0
+    scheduler.release()
+    assert scheduler.in_use == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_releases_slot(monkeypatch):
+    scheduler = FairScheduler(capacity=1)
+    tenant = _tenant()
+    await scheduler.acquire(tenant, timeout=1)
+
+    # 排隊中被取消：不佔名額，釋放時跳過
+    queued = asyncio.create_task(scheduler.acquire(tenant, timeout=5))
+    await asyncio.sleep(0)
+    queued.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await queued
+    assert scheduler.depth == 0
+
+    # 已分到名額的同時被取消：名額轉交下一位
+    waiting = asyncio.create_task(scheduler.acquire(tenant, timeout=5))
+    await asyncio.sleep(0)
+    real_wait_for = asyncio.wait_for
+
+    async def grant_then_cancel(awaitable, timeout):
+        scheduler.release()
+        awaitable.cancel()
+        raise asyncio.CancelledError
+
+    # 權重較高，會比 waiting 先分到名額
+    urgent = _tenant(weight=100)
+    monkeypatch.setattr(admission.asyncio, "wait_for", grant_then_cancel)
+    with pytest.raises(asyncio.CancelledError):
+        await scheduler.acquire(urgent, timeout=5)
+    monkeypatch.setattr(admission.asyncio, "wait_for", real_wait_for)
+    await asyncio.wait_for(waiting, timeout=1)
+    assert scheduler.in_use == 1
+    scheduler.release()
+    assert scheduler.in_use == 0
+    assert tenant.queued == 0 and urgent.queued == 0
@@ -87,3 +87,440 @@ async def test_transaction_balance_flow(capfd):
             result_lines.append(f"uid={uid}, point_rule_id={point_rule_id}, final_balance={balance}")
     out, err = capfd.readouterr()
     print("\n".join(result_lines))
+
+@pytest.mark.asyncio
+async def test_transfer_contention_benchmark():
+    """大量交叉轉點併發：不可死結、不可透支、總點數守恆"""
+    import time
+    async with AsyncClient(base_url="http://localhost:8030", timeout=60) as client:
+        resp = await client.post("/api/v1/merchants/register", params={"name": f"test_transfer_{random.randint(1, 10**9)}"})
+        assert resp.status_code == 200
+        merchant_id = resp.json()["data"]["id"]
+        resp = await client.post(f"/api/v1/merchants/{merchant_id}/apikey")
+        assert resp.status_code == 200
+        headers = {"x-api-key": resp.json()["data"]["api_key"]}
+
+        rule_ids = []
+        for name in ("transfer_rule_a", "transfer_rule_b"):
+            resp = await client.post("/api/v1/points/rules", params={"name": name, "rate": 1.0}, headers=headers)
+            assert resp.status_code == 200
+            rule_ids.append(resp.json()["data"]["id"])
+
+        uids = [str(i) for i in range(1, 6)]
+        for uid in uids:
+            for rule_id in rule_ids:
+                r = await client.post("/api/v1/points/transactions", params={"uid": uid, "point_rule_id": rule_id, "amount": 100}, headers=headers)
+                assert r.status_code == 200
+
+        # 2. 交叉轉點：會員互轉（同規則）與規則互換（同會員）同時進行
+        status_codes = []
+
+        async def cross_transfer():
+            for _ in range(50):
+                src, dst = random.sample(uids, 2)
+                rule_id = random.choice(rule_ids)
+                amount = random.randint(1, 30)
+                if random.random() < 0.5:
+                    legs = [
+                        {"uid": src, "point_rule_id": rule_id, "amount": -amount},
+                        {"uid": dst, "point_rule_id": rule_id, "amount": amount},
+                    ]
+                else:
+                    legs = [
+                        {"uid": src, "point_rule_id": rule_id, "amount": -amount},
+                        {"uid": src, "point_rule_id": rule_ids[0] if rule_id == rule_ids[1] else rule_ids[1], "amount": amount},
+                    ]
+                r = await client.post("/api/v1/points/transfers", json={"legs": legs}, headers=headers)
+                status_codes.append(r.status_code)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[cross_transfer() for _ in range(20)])
+        elapsed = time.perf_counter() - started
+
+        # 只允許成功或透支拒絕，不可出現死結造成的 500
+        assert set(status_codes) <= {200, 400}
+        print(f"transfers={len(status_codes)}, ok={status_codes.count(200)}, rejected={status_codes.count(400)}, "
+              f"elapsed={elapsed:.2f}s, throughput={len(status_codes) / elapsed:.1f}/s")
+
+        # 3. 驗證餘額：不為負、且總點數守恆
+        resp = await client.get("/api/v1/points/transactions", params={"sort": "id"}, headers=headers)
+        assert resp.status_code == 200
+        latest = {}
+        for tx in resp.json()["data"]:
+            latest[(tx["uid"], tx["point_rule_id"])] = tx["balance"]
+        assert all(balance >= 0 for balance in latest.values())
+        assert sum(latest.values()) == 100 * len(uids) * len(rule_ids)
+
+@pytest.mark.asyncio
+async def test_leaderboard():
+    async with AsyncClient(base_url="http://localhost:8030") as client:
+        resp = await client.post("/api/v1/merchants/register", params={"name": f"test_leaderboard_{random.randint(1, 10**9)}"})
+        assert resp.status_code == 200
+        merchant_id = resp.json()["data"]["id"]
+        resp = await client.post(f"/api/v1/merchants/{merchant_id}/apikey")
+        headers = {"x-api-key": resp.json()["data"]["api_key"]}
+        resp = await client.post("/api/v1/points/rules", params={"name": "leaderboard_rule", "rate": 1.0}, headers=headers)
+        rule_id = resp.json()["data"]["id"]
+
+        for uid, amounts in {"a": [50, 20], "b": [90, -10], "c": [10], "d": [70]}.items():
+            for amount in amounts:
+                r = await client.post("/api/v1/points/transactions", params={"uid": uid, "point_rule_id": rule_id, "amount": amount}, headers=headers)
+                assert r.status_code == 200
+
+        resp = await client.get(f"/api/v1/points/rules/{rule_id}/leaderboard", params={"limit": 3}, headers=headers)
+        assert resp.status_code == 200
+        assert [(r["rank"], r["uid"], r["balance"]) for r in resp.json()["data"]] == [(1, "b", 80), (2, "a", 70), (2, "d", 70)]
+
+        resp = await client.get(f"/api/v1/points/rules/{rule_id}/leaderboard/c", headers=headers)
+        assert resp.status_code == 200
+        assert resp.json()["data"]["rank"] == 4
+
+        resp = await client.get(f"/api/v1/points/rules/{rule_id}/leaderboard/nobody", headers=headers)
+        assert resp.status_code == 404
+
+@pytest.mark.asyncio
+async def test_import_transactions():
+    async with AsyncClient(base_url="http://localhost:8030", timeout=60) as client:
+        resp = await client.post("/api/v1/merchants/register", params={"name": f"test_import_{random.randint(1, 10**9)}"})
+        merchant_id = resp.json()["data"]["id"]
+        resp = await client.post(f"/api/v1/merchants/{merchant_id}/apikey")
+        headers = {"x-api-key": resp.json()["data"]["api_key"]}
+        resp = await client.post("/api/v1/points/rules", params={"name": "import_rule", "rate": 1.0}, headers=headers)
+        rule_id = resp.json()["data"]["id"]
+
+        lines = ["uid,point_rule_id,amount,detail,created_at"]
+        for i in range(1000):
+            lines.append(f'{i % 7},{rule_id},{i % 11 - 3},"{{""legacy_id"": {i}}}",2020-01-01T00:00:00')
+        content = "\n".join(lines).encode("utf-8")
+
+        resp = await client.post(
+            "/api/v1/points/transactions/import",
+            params={"import_key": "legacy", "chunk_size": 100},
+            files={"file": ("legacy.csv", content, "text/csv")},
+            headers=headers,
+        )
+        assert resp.status_code == 200
+        assert resp.json()["data"]["rows"] == 1000
+
+        # 相同 import_key 已完成，重送不會重複寫入
+        resp = await client.post(
+            "/api/v1/points/transactions/import",
+            params={"import_key": "legacy"},
+            files={"file": ("legacy.csv", content, "text/csv")},
+            headers=headers,
+        )
+        assert resp.json()["data"]["rows"] == 0
+
+        resp = await client.get("/api/v1/points/transactions", params={"sort": "id"}, headers=headers)
+        txs = resp.json()["data"]
+        assert len(txs) == 1000
+        balances = {}
+        for tx in txs:
+            key = (tx["uid"], tx["point_rule_id"])
+            assert balances.get(key, 0) + tx["amount"] == tx["balance"]
+            balances[key] = tx["balance"]
+
+        resp = await client.get(f"/api/v1/points/rules/{rule_id}/leaderboard/0", headers=headers)
+        assert resp.json()["data"]["balance"] == balances[("0", rule_id)]
+
+@pytest.mark.asyncio
+async def test_transactions_pagination():
+    async with AsyncClient(base_url="http://localhost:8030") as client:
+        resp = await client.post("/api/v1/merchants/register", params={"name": f"test_page_{random.randint(1, 10**9)}"})
+        merchant_id = resp.json()["data"]["id"]
+        resp = await client.post(f"/api/v1/merchants/{merchant_id}/apikey")
+        headers = {"x-api-key": resp.json()["data"]["api_key"]}
+        resp = await client.post("/api/v1/points/rules", params={"name": "page_rule", "rate": 1.0}, headers=headers)
+        rule_id = resp.json()["data"]["id"]
+        for i in range(25):
+            r = await client.post("/api/v1/points/transactions", params={"uid": f"u{i % 2}", "point_rule_id": rule_id, "amount": 1}, headers=headers)
+            assert r.status_code == 200
+
+        # keyset 分頁：依 id 由新到舊，逐頁帶入上一頁最後一筆 id
+        seen, before_id = [], None
+        while True:
+            params = {"uid": "u0", "limit": 5}
+            if before_id is not None:
+                params["before_id"] = before_id
+            resp = await client.get("/api/v1/points/transactions", params=params, headers=headers)
+            assert resp.status_code == 200
+            page = resp.json()["data"]
+            if not page:
+                break
+            assert all(tx["uid"] == "u0" for tx in page)
+            seen.extend(tx["id"] for tx in page)
+            before_id = page[-1]["id"]
+        assert len(seen) == 13
+        assert seen == sorted(seen, reverse=True)
+
+        resp = await client.get("/api/v1/points/transactions", params={"point_rule_id": rule_id, "end": "2000-01-01"}, headers=headers)
+        assert resp.json()["data"] == []
+
+@pytest.mark.asyncio
+async def test_auth_cache_survives_rollback():
+    async with AsyncClient(base_url="http://localhost:8030") as client:
+        resp = await client.post("/api/v1/merchants/register", params={"name": f"test_auth_cache_{random.randint(1, 10**9)}"})
+        merchant_id = resp.json()["data"]["id"]
+        resp = await client.post(f"/api/v1/merchants/{merchant_id}/apikey")
+        headers = {"x-api-key": resp.json()["data"]["api_key"]}
+        resp = await client.post("/api/v1/points/rules", params={"name": "auth_cache_rule", "rate": 1.0}, headers=headers)
+        rule_id = resp.json()["data"]["id"]
+
+        # 透支的轉點會 rollback 請求的 session，之後同一把 key 的請求仍須通過驗證
+        resp = await client.post("/api/v1/points/transfers", json={"legs": [{"uid": "a", "point_rule_id": rule_id, "amount": -1}]}, headers=headers)
+        assert resp.status_code == 400
+        for _ in range(3):
+            resp = await client.get("/api/v1/points/rules", headers=headers)
+            assert resp.status_code == 200
+
+@pytest.mark.asyncio
+async def test_import_rejects_malformed_upload():
+    async with AsyncClient(base_url="http://localhost:8030") as client:
+        resp = await client.post("/api/v1/merchants/register", params={"name": f"test_import_bad_{random.randint(1, 10**9)}"})
+        merchant_id = resp.json()["data"]["id"]
+        resp = await client.post(f"/api/v1/merchants/{merchant_id}/apikey")
+        headers = {"x-api-key": resp.json()["data"]["api_key"]}
+        resp = await client.post("/api/v1/points/rules", params={"name": "import_rule", "rate": 1.0}, headers=headers)
+        rule_id = resp.json()["data"]["id"]
+
+        content = f'{{"uid": "a", "point_rule_id": {rule_id}, "amount": 1}}\nnot json\n'.encode("utf-8")
+        resp = await client.post(
+            "/api/v1/points/transactions/import",
+            params={"import_key": "bad_json"},
+            files={"file": ("legacy.ndjson", content, "application/x-ndjson")},
+            headers=headers,
+        )
+        assert resp.status_code == 400
+        assert "#2" in resp.json()["data"]["detail"]
+
+        resp = await client.post(
+            "/api/v1/points/transactions/import",
+            params={"import_key": "bad_encoding"},
+            files={"file": ("legacy.csv", b"uid,point_rule_id,amount\n\xff\xfe,1,1\n", "text/csv")},
+            headers=headers,
+        )
+        assert resp.status_code == 400
+
+async def _tenant_engine(merchant_id):
+    """測試程序直接連到商戶所在 shard 的 engine"""
+    from app.db.session import AsyncSessionLocal
+    from app.db.shards import shard_registry
+    from app.services.shard_service import get_merchant_shard
+    async with AsyncSessionLocal() as db:
+        shard, _ = await get_merchant_shard(db, merchant_id)
+    return shard_registry.get_engine(shard)
+
+async def _register_tenant(client, prefix):
+    resp = await client.post("/api/v1/merchants/register", params={"name": f"{prefix}_{random.randint(1, 10**9)}"})
+    merchant_id = resp.json()["data"]["id"]
+    resp = await client.post(f"/api/v1/merchants/{merchant_id}/apikey")
+    headers = {"x-api-key": resp.json()["data"]["api_key"]}
+    resp = await client.post("/api/v1/points/rules", params={"name": f"{prefix}_rule", "rate": 1.0}, headers=headers)
+    return merchant_id, headers, resp.json()["data"]["id"]
+
+@pytest.mark.asyncio
+async def test_outbox_dispatcher_delivers_to_webhook_stub():
+    import socket
+    import subprocess
+    import sys
+    from datetime import timedelta
+    from sqlalchemy import text
+    from app.services.outbox_dispatcher import OutboxDispatcher
+    from app.utils.timezone import timezone_manager
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "app.tools.webhook_stub", "--port", str(port)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    assert stub.stdout.readline().startswith("listening")
+
+    async with AsyncClient(base_url="http://localhost:8030") as client:
+        merchant_id, _, _ = await _register_tenant(client, "test_outbox")
+    schema_name = f"merchant_{merchant_id}"
+    engine = await _tenant_engine(merchant_id)
+    try:
+        # 時間欄位以系統時區的 naive datetime 儲存
+        now = timezone_manager.now().replace(tzinfo=None)
+        due = now - timedelta(minutes=1)
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(f'INSERT INTO "{schema_name}".outbox_events (event_type, payload, status, attempts, next_attempt_at, created_at) '
+                     "SELECT 'balance.changed', jsonb_build_object('n', n), 'pending', 0, :due, :now FROM generate_series(1, 5) AS n"),
+                {"due": due, "now": now}
+            )
+
+        # 無法連線的 URL：事件保持 pending 並延後重試
+        failing = OutboxDispatcher(urls=["http://127.0.0.1:1/events"], batch_size=10)
+        assert await failing.dispatch_schema(engine, schema_name) == 5
+        await failing.close()
+        async with engine.connect() as conn:
+            rows = (await conn.execute(
+                text(f'SELECT status, attempts, next_attempt_at > :now FROM "{schema_name}".outbox_events'), {"now": now}
+            )).all()
+        assert all(row == ("pending", 1, True) for row in rows)
+
+        async with engine.begin() as conn:
+            await conn.execute(text(f'UPDATE "{schema_name}".outbox_events SET next_attempt_at = :due'), {"due": due})
+        dispatcher = OutboxDispatcher(urls=[f"http://127.0.0.1:{port}/events"], batch_size=10)
+        assert await dispatcher.dispatch_schema(engine, schema_name) == 5
+        # 已送達的事件不會再被領取
+        assert await dispatcher.dispatch_schema(engine, schema_name) == 0
+        await dispatcher.close()
+        async with engine.connect() as conn:
+            rows = (await conn.execute(text(f'SELECT id, status, attempts FROM "{schema_name}".outbox_events'))).all()
+        assert all(status == "delivered" and attempts == 2 for _, status, attempts in rows)
+    finally:
+        await engine.dispose()
+        stub.terminate()
+    received = stub.communicate()[0].splitlines()
+    assert sorted(line.split()[0] for line in received) == sorted(f"{merchant_id}:{row.id}" for row in rows)
+
+@pytest.mark.asyncio
+async def test_verify_and_repair_ledger():
+    from sqlalchemy import text
+    from app.db.session import engine as default_engine
+    from app.db.shards import shard_registry
+    from app.services.ledger_verifier import verify_ledgers, repair_member_ledger
+
+    async with AsyncClient(base_url="http://localhost:8030") as client:
+        merchant_id, headers, rule_id = await _register_tenant(client, "test_verify")
+        for uid, amount in [("a", 10), ("a", 20), ("b", 5), ("a", -5), ("a", 7), ("b", 1)]:
+            r = await client.post("/api/v1/points/transactions", params={"uid": uid, "point_rule_id": rule_id, "amount": amount}, headers=headers)
+            assert r.status_code == 200
+        resp = await client.get("/api/v1/points/transactions", params={"uid": "a", "sort": "id"}, headers=headers)
+        a_ids = [tx["id"] for tx in resp.json()["data"]]
+
+    schema_name = f"merchant_{merchant_id}"
+    engine = await _tenant_engine(merchant_id)
+    try:
+        # 竄改 a 的第三筆餘額與排行榜餘額，之後的流水也會跟著對不上
+        async with engine.begin() as conn:
+            await conn.execute(text(f'UPDATE "{schema_name}".transactions SET balance = balance + 100 WHERE id = :id'), {"id": a_ids[2]})
+            await conn.execute(text(f'UPDATE "{schema_name}".member_balances SET balance = 0 WHERE uid = \'a\''))
+
+        report = await verify_ledgers(merchant_ids=[merchant_id], chunk_size=2)
+        divergences = report[schema_name]["divergences"]
+        assert [(d["uid"], d["id"], d["expected"], d["actual"]) for d in divergences] == [("a", a_ids[2], 25, 125)]
+
+        assert await repair_member_ledger(engine, schema_name, "a", rule_id, a_ids[2]) == 1
+        report = await verify_ledgers(merchant_ids=[merchant_id])
+        assert report[schema_name]["divergences"] == []
+        async with engine.connect() as conn:
+            result = await conn.execute(text(f'SELECT uid, balance FROM "{schema_name}".member_balances ORDER BY uid'))
+            assert [tuple(row) for row in result.all()] == [("a", 32), ("b", 6)]
+    finally:
+        await shard_registry.dispose()
+        await default_engine.dispose()
+
+@pytest.mark.asyncio
+async def test_transfer_leg_limit():
+    async with AsyncClient(base_url="http://localhost:8030") as client:
+        _, headers, rule_id = await _register_tenant(client, "test_transfer_limit")
+        legs = [{"uid": f"u{i}", "point_rule_id": rule_id, "amount": 0} for i in range(101)]
+        resp = await client.post("/api/v1/points/transfers", json={"legs": legs}, headers=headers)
+        assert resp.status_code == 422
+        resp = await client.post("/api/v1/points/transfers", json={"legs": legs[:100]}, headers=headers)
+        assert resp.status_code == 200
+
+def _require_shards():
+    from app.db.shards import shard_registry
+    if len(shard_registry.names()) < 2:
+        pytest.skip("需要 SHARD_DATABASE_URLS（docker-compose --profile shards up）")
+
+async def _directory(merchant_id):
+    from app.db.session import AsyncSessionLocal
+    from app.services.shard_service import get_merchant_shard
+    async with AsyncSessionLocal() as db:
+        return await get_merchant_shard(db, merchant_id)
+
+@pytest.mark.asyncio
+async def test_choose_shard_places_on_least_loaded():
+    _require_shards()
+    from app.db.session import AsyncSessionLocal, engine as default_engine
+    from app.services.shard_service import choose_shard
+    try:
+        async with AsyncSessionLocal() as db:
+            expected = await choose_shard(db)
+        async with AsyncClient(base_url="http://localhost:8030") as client:
+            merchant_id, headers, rule_id = await _register_tenant(client, "test_shard_place")
+            assert await _directory(merchant_id) == (expected, "active")
+            # 租戶 API 走該 shard 的連線池
+            r = await client.post("/api/v1/points/transactions", params={"uid": "a", "point_rule_id": rule_id, "amount": 3}, headers=headers)
+            assert r.status_code == 200
+            resp = await client.get("/api/v1/points/transactions", params={"uid": "a"}, headers=headers)
+            assert [tx["balance"] for tx in resp.json()["data"]] == [3]
+    finally:
+        await default_engine.dispose()
+
+@pytest.mark.asyncio
+async def test_move_tenant_between_shards():
+    _require_shards()
+    from sqlalchemy import text
+    from sqlalchemy.exc import DBAPIError
+    from app.db.session import engine as default_engine
+    from app.db.shards import shard_registry
+    from app.services.shard_service import move_tenant
+
+    async with AsyncClient(base_url="http://localhost:8030") as client:
+        merchant_id, headers, rule_id = await _register_tenant(client, "test_shard_move")
+        for amount in (10, 20, -5):
+            r = await client.post("/api/v1/points/transactions", params={"uid": "a", "point_rule_id": rule_id, "amount": amount}, headers=headers)
+            assert r.status_code == 200
+        schema_name = f"merchant_{merchant_id}"
+        source_shard, _ = await _directory(merchant_id)
+        target_shard = next(name for name in shard_registry.names() if name != source_shard)
+        try:
+            await move_tenant(merchant_id, target_shard, batch_size=2, drain_seconds=0)
+            assert await _directory(merchant_id) == (target_shard, "active")
+
+            # 快取經由 invalidation 失效後，API 改走目標 shard，餘額接續
+            for _ in range(20):
+                r = await client.post("/api/v1/points/transactions", params={"uid": "a", "point_rule_id": rule_id, "amount": 1}, headers=headers)
+                if r.status_code == 200:
+                    break
+                await asyncio.sleep(0.5)
+            assert r.status_code == 200
+            resp = await client.get("/api/v1/points/transactions", params={"uid": "a", "sort": "id"}, headers=headers)
+            txs = resp.json()["data"]
+            assert [tx["balance"] for tx in txs] == [10, 30, 25, 26]
+
+            # 原 schema 改名保留且拒絕寫入
+            async with shard_registry.get_engine(source_shard).connect() as conn:
+                result = await conn.execute(
+                    text("SELECT nspname FROM pg_namespace WHERE nspname LIKE :prefix"), {"prefix": f"{schema_name}_moved_%"}
+                )
+                moved_name = result.scalar_one()
+                with pytest.raises(DBAPIError):
+                    await conn.execute(text(f'DELETE FROM "{moved_name}".transactions'))
+        finally:
+            await shard_registry.dispose()
+            await default_engine.dispose()
+
+@pytest.mark.asyncio
+async def test_move_tenant_refused_during_import():
+    _require_shards()
+    from sqlalchemy import text
+    from app.db.session import engine as default_engine
+    from app.db.shards import shard_registry
+    from app.services.shard_service import move_tenant
+    from app.services.transaction_service import advisory_lock_key
+
+    async with AsyncClient(base_url="http://localhost:8030") as client:
+        merchant_id, _, _ = await _register_tenant(client, "test_shard_import")
+    source_shard, _ = await _directory(merchant_id)
+    target_shard = next(name for name in shard_registry.names() if name != source_shard)
+    lock_key = advisory_lock_key(f"ledger_import:merchant_{merchant_id}", 0)
+    try:
+        # 模擬進行中的匯入（import_service 以 session 層級持有同一把鎖）
+        async with shard_registry.get_engine(source_shard).connect() as conn:
+            await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": lock_key})
+            with pytest.raises(ValueError):
+                await move_tenant(merchant_id, target_shard, drain_seconds=0)
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": lock_key})
+        assert await _directory(merchant_id) == (source_shard, "active")
+    finally:
+        await shard_registry.dispose()
+        await default_engine.dispose()
@@ -0,0 +1,71 @@
+import pytest
+from dotenv import load_dotenv
+load_dotenv(dotenv_path="app/.env")
+import app.db.replica as replica
+from app.db.replica import ReplicaRouter, estimate_replica_lag, parse_lsn
+
+def test_parse_lsn():
+    assert parse_lsn("0/16B3748") == 0x16B3748
+    assert parse_lsn("1/0") == 1 << 32
+    assert parse_lsn("1/0") > parse_lsn("0/FFFFFFFF")
+    assert parse_lsn("garbage") is None
+    assert parse_lsn(None) is None
+
+def test_estimate_replica_lag():
+    # 已重播到主庫目前位置：即使最後一筆交易很久以前也沒有延遲
+    assert estimate_replica_lag("0/3000", "0/3000", 600, "streaming") == 0
+    assert estimate_replica_lag("0/3000", "0/3000", 600, None) == 0
+    # 尚未追上：以最後重播交易距今秒數估計
+    assert estimate_replica_lag("0/3000", "0/2000", 2.5, "streaming") == 2.5
+    # WAL receiver 斷線且尚未追上：無法判斷
+    assert estimate_replica_lag("0/3000", "0/2000", 0.1, None) is None
+    assert estimate_replica_lag("0/3000", "0/2000", 0.1, "waiting") is None
+    # 不是副本（沒有重播位置）
+    assert estimate_replica_lag("0/3000", None, None, None) is None
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("lag, read_token_replayed, read_token, expected", [
+    (0.0, True, None, True),
+    (0.5, True, None, True),
+    (30.0, True, None, False),
+    (None, True, None, False),
+    (0.0, False, "0/3000", False),
+    (0.0, True, "0/3000", True),
+])
+async def test_replica_routing(monkeypatch, lag, read_token_replayed, read_token, expected):
+    monkeypatch.setattr(replica, "replica_engine", object())
+    monkeypatch.setattr(replica.settings, "replica_max_lag_seconds", 5.0)
+    router = ReplicaRouter()
+
+    async def probe_lag():
+        return lag
+
+    async def has_replayed(token):
+        return read_token_replayed
+
+    monkeypatch.setattr(router, "_probe_lag", probe_lag)
+    monkeypatch.setattr(router, "_has_replayed", has_replayed)
+    assert await router.use_replica(read_token) is expected
+
+@pytest.mark.asyncio
+async def test_replica_routing_probe_failure(monkeypatch):
+    monkeypatch.setattr(replica, "replica_engine", object())
+    router = ReplicaRouter()
+
+    async def probe_lag():
+        raise ConnectionError("replica down")
+
+    monkeypatch.setattr(router, "_probe_lag", probe_lag)
+    assert await router.use_replica() is False
+
+@pytest.mark.asyncio
+async def test_search_path_does_not_check_out_connection():
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from app.core.multi_tenancy import set_search_path
+    # 無法連線的主庫：走副本的請求只設定租戶 session，不應向主庫取連線
+    unreachable = create_async_engine("postgresql+asyncpg://u:p@127.0.0.1:1/db")
+    async with AsyncSession(unreachable) as session:
+        await set_search_path(session, "merchant_1")
+        assert not session.in_transaction()
+    assert unreachable.pool.checkedout() == 0
+    await unreachable.dispose()
@@ -0,0 +1,29 @@
+"""
+以 CREATE INDEX CONCURRENTLY 為既有租戶補建新增的索引，並移除已被取代的舊索引
+
+    python -m app.tools.build_indexes
+    python -m app.tools.build_indexes --merchant-id 5
+
+升級後執行一次即可；建索引期間不阻擋寫入，可重複執行（已存在且有效的索引會略過）。
+"""
+import argparse
+import asyncio
+import json
+from app.db.shards import shard_registry
+from app.services.index_service import sync_all_tenant_indexes
+
+def main():
+    parser = argparse.ArgumentParser(description="Build missing tenant indexes concurrently and drop superseded ones")
+    parser.add_argument("--merchant-id", type=int, action="append", help="只處理指定商戶，可重複指定；預設全部")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            return await sync_all_tenant_indexes(args.merchant_id)
+        finally:
+            await shard_registry.dispose()
+
+    print(json.dumps(asyncio.run(run()), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+以 COPY 匯入商戶的歷史流水（CSV 或 NDJSON）
+
+    python -m app.tools.import_ledger --merchant-id 5 --file legacy.csv
+    python -m app.tools.import_ledger --merchant-id 5 --file legacy.ndjson --format ndjson --import-key legacy-2024
+"""
+import argparse
+import asyncio
+import os
+from app.db.session import AsyncSessionLocal
+from app.db.shards import shard_registry
+from app.services.import_service import import_ledger, iter_ledger_records
+from app.services.shard_service import get_merchant_shard
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import legacy ledger rows into a merchant's transactions")
+    parser.add_argument("--merchant-id", type=int, required=True)
+    parser.add_argument("--file", required=True)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default=None, help="未指定時依副檔名判斷")
+    parser.add_argument("--import-key", default=None, help="續傳識別，預設為檔名")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    indexes = parser.add_mutually_exclusive_group()
+    indexes.add_argument("--defer-indexes", dest="defer_indexes", action="store_const", const=True, default=None,
+                         help="匯入期間移除次要索引（預設只在商戶尚無流水時移除）")
+    indexes.add_argument("--keep-indexes", dest="defer_indexes", action="store_const", const=False, help="匯入期間保留索引")
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.file.endswith((".ndjson", ".jsonl")) else "csv")
+
+    async def run():
+        async with AsyncSessionLocal() as db:
+            shard, status = await get_merchant_shard(db, args.merchant_id)
+        try:
+            with open(args.file, encoding="utf-8", newline="") as f:
+                stats = await import_ledger(
+                    engine=shard_registry.get_engine(shard),
+                    schema_name=f"merchant_{args.merchant_id}",
+                    records=iter_ledger_records(f, fmt),
+                    import_key=args.import_key or os.path.basename(args.file),
+                    chunk_size=args.chunk_size,
+                    defer_indexes=args.defer_indexes,
+                )
+        finally:
+            await shard_registry.dispose()
+        print(f"rows={stats['rows']} offset={stats['offset']} elapsed={stats['elapsed']}s rows/sec={stats['rows_per_sec']}")
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
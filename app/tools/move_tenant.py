@@ -0,0 +1,35 @@
+"""
+線上搬移租戶 schema 到另一個 shard
+
+    python -m app.tools.move_tenant --merchant-id 5 --target shard2
+"""
+import argparse
+import asyncio
+from app.db.shards import shard_registry
+from app.services.shard_service import move_tenant
+
+def main():
+    parser = argparse.ArgumentParser(description="Move a merchant schema to another shard")
+    parser.add_argument("--merchant-id", type=int, required=True)
+    parser.add_argument("--target", required=True, help=f"目標 shard：{', '.join(shard_registry.names())}")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--drain-seconds", type=float, default=None, help="凍結寫入後等待進行中請求的秒數")
+    parser.add_argument("--drop-source", action="store_true", help="完成後刪除原 schema（預設改名保留）")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            await move_tenant(
+                merchant_id=args.merchant_id,
+                target_shard=args.target,
+                batch_size=args.batch_size,
+                drain_seconds=args.drain_seconds,
+                drop_source=args.drop_source,
+            )
+        finally:
+            await shard_registry.dispose()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+執行 outbox dispatcher，將餘額異動事件投遞到 OUTBOX_WEBHOOK_URLS
+
+    python -m app.tools.outbox_dispatcher --workers 4
+
+可同時啟動多個 process，事件以 FOR UPDATE SKIP LOCKED 領取並設定租約，不會重複投遞同一批。
+"""
+import argparse
+import asyncio
+import signal
+from app.db.shards import shard_registry
+from app.services.outbox_dispatcher import OutboxDispatcher
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver outbox events to configured webhooks")
+    parser.add_argument("--workers", type=int, default=1, help="同一 process 內並行的 worker 數")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--once", action="store_true", help="只處理一輪後結束")
+    args = parser.parse_args()
+
+    async def run():
+        dispatcher = OutboxDispatcher(batch_size=args.batch_size)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            if args.once:
+                processed = await dispatcher.run_once()
+                print(f"processed={processed}")
+            else:
+                await asyncio.gather(*[dispatcher.run(stop) for _ in range(args.workers)])
+        finally:
+            await dispatcher.close()
+            await shard_registry.dispose()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+檢查（並可修復）各租戶流水的 balance 連續性
+
+    python -m app.tools.verify_ledger --workers 8
+    python -m app.tools.verify_ledger --merchant-id 5 --repair
+
+有不一致且未修復時 exit code 為 1。
+"""
+import argparse
+import asyncio
+import json
+import sys
+from app.db.shards import shard_registry
+from app.services.ledger_verifier import verify_ledgers, repair_ledgers
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify balance = previous balance + amount for every member ledger")
+    parser.add_argument("--merchant-id", type=int, action="append", help="只檢查指定商戶，可重複指定；預設全部")
+    parser.add_argument("--workers", type=int, default=4, help="同時執行的查詢數")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="每個查詢涵蓋的 id 範圍")
+    parser.add_argument("--epsilon", type=float, default=1e-6)
+    parser.add_argument("--repair", action="store_true", help="從第一筆不一致處重算後續 balance")
+    parser.add_argument("--batch-size", type=int, default=1000, help="修復時每個交易更新的筆數")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            report = await verify_ledgers(args.merchant_id, args.workers, args.chunk_size, args.epsilon)
+            divergent = sum(len(item["divergences"]) for item in report.values())
+            result = {"report": report, "divergent_members": divergent}
+            if args.repair and divergent:
+                result["repaired_rows"] = await repair_ledgers(report, args.workers, args.batch_size)
+            print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+            return 1 if divergent and not args.repair else 0
+        finally:
+            await shard_registry.dispose()
+
+    sys.exit(asyncio.run(run()))
+
+if __name__ == "__main__":
+    main()
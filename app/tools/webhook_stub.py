@@ -0,0 +1,43 @@
+"""
+本機測試用的 webhook 接收端，印出收到的事件
+
+    python -m app.tools.webhook_stub --port 9000 --fail-rate 0.2
+    OUTBOX_WEBHOOK_URLS='["http://localhost:9000/events"]'
+"""
+import argparse
+import json
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub webhook receiver for outbox testing")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="隨機回傳 500 的比例，用來測試重試")
+    args = parser.parse_args()
+    seen = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("content-length", 0)))
+            if random.random() < args.fail_rate:
+                status = 500
+            else:
+                status = 200
+                event = json.loads(body)
+                duplicate = event["id"] in seen
+                seen.add(event["id"])
+                print(f"{'DUP ' if duplicate else ''}{event['id']} {event['type']} {json.dumps(event['data'], ensure_ascii=False)}", flush=True)
+            self.send_response(status)
+            self.send_header("content-length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"listening on :{args.port}", flush=True)
+    ThreadingHTTPServer(("0.0.0.0", args.port), Handler).serve_forever()
+
+if __name__ == "__main__":
+    main()
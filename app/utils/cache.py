@@ -0,0 +1,44 @@
+import time
+from typing import Any, Callable, Hashable, Optional
+
+class TTLCache:
+    """簡單的 process 內快取，每筆資料在 ttl 秒後過期"""
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        if len(self._data) >= self.maxsize:
+            self._evict()
+        self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def invalidate(self, predicate: Callable[[Hashable, Any], bool]):
+        """移除所有 predicate(key, value) 為真的資料"""
+        for key in [k for k, (_, value) in self._data.items() if predicate(k, value)]:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _) in self._data.items() if expires_at < now]:
+            self._data.pop(key, None)
+        # 仍然太滿時丟掉最早寫入的資料
+        while len(self._data) >= self.maxsize:
+            self._data.pop(next(iter(self._data)))
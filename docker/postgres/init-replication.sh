@@ -0,0 +1,4 @@
+#!/bin/bash
+# 主庫初始化時允許副本以串流複寫連線（僅在全新的 db_data volume 上執行）
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,13 @@
+#!/bin/bash
+# 以 pg_basebackup 從主庫建立 hot standby，之後交給官方 entrypoint 啟動
+set -e
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+  mkdir -p "$PGDATA"
+  until pg_basebackup -h "$PRIMARY_HOST" -U "$POSTGRES_USER" -D "$PGDATA" -R -X stream; do
+    echo "waiting for primary $PRIMARY_HOST ..."
+    rm -rf "$PGDATA"/*
+    sleep 2
+  done
+  chmod 700 "$PGDATA"
+fi
+exec docker-entrypoint.sh postgres
@@ -1,65 +1,163 @@
 import gradio as gr
 import requests
+import json
 import os
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 API_BASE = os.getenv("API_BASE", "http://localhost:8030/api/v1")
+REQUEST_TIMEOUT = float(os.getenv("PANEL_REQUEST_TIMEOUT", "10"))
+CACHE_TTL = float(os.getenv("PANEL_CACHE_TTL", "10"))
+CACHE_MAX_ENTRIES = 500
+PAGE_SIZES = [20, 50, 100, 200]
+
+# 共用連線池，keep-alive 連線在每次刷新之間重複使用
+# GET 遇到 429/502/503/504 時依 Retry-After 或退避重試
+session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504], allowed_methods=["GET"]),
+)
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
+# (x-api-key, path, params) -> (過期時間, data)，寫入成功後清除該 API key 的快取
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _request(method, path, x_api_key=None, **kwargs):
+    headers = {"x-api-key": x_api_key} if x_api_key else None
+    return session.request(method, f"{API_BASE}{path}", headers=headers, timeout=REQUEST_TIMEOUT, **kwargs)
+
+
+def _cached_get(path, x_api_key=None, params=None):
+    """GET 並回傳 data，CACHE_TTL 秒內相同 API key 與參數直接使用快取；失敗時拋出 RuntimeError"""
+    key = (x_api_key, path, tuple(sorted((params or {}).items())))
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+    try:
+        resp = _request("GET", path, x_api_key, params=params)
+    except requests.RequestException as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}")
+    if not resp.ok:
+        raise RuntimeError(resp.text)
+    data = resp.json()["data"]
+    with _cache_lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            for k in [k for k, (expires, _) in _cache.items() if expires <= now]:
+                del _cache[k]
+            if len(_cache) >= CACHE_MAX_ENTRIES:
+                _cache.clear()
+        _cache[key] = (now + CACHE_TTL, data)
+    return data
+
+
+def _invalidate(x_api_key=None):
+    with _cache_lock:
+        for k in [k for k in _cache if k[0] == x_api_key]:
+            del _cache[k]
+
 
 def list_merchants():
-    resp = requests.get(f"{API_BASE}/merchants/")
-    if resp.ok:
-        data = resp.json()["data"]
-        return [[m["id"], m["name"], m["created_at"]] for m in data]
-    return []
+    try:
+        data = _cached_get("/merchants/")
+    except RuntimeError:
+        return []
+    return [[m["id"], m["name"], m["created_at"]] for m in data]
 
 def register_merchant(name):
-    resp = requests.post(f"{API_BASE}/merchants/register", params={"name": name})
+    resp = _request("POST", "/merchants/register", params={"name": name})
     if resp.ok:
+        _invalidate()
         return resp.json()["message"]
     return resp.text
 
 def create_api_key(merchant_id, days):
-    resp = requests.post(f"{API_BASE}/merchants/{merchant_id}/apikey", params={"expires_in_days": days})
+    resp = _request("POST", f"/merchants/{int(merchant_id)}/apikey", params={"expires_in_days": days})
     if resp.ok:
         return resp.json()["data"]["api_key"]
     return resp.text
 
 def list_point_rules(x_api_key):
-    resp = requests.get(f"{API_BASE}/points/rules", headers={"x-api-key": x_api_key})
-    if resp.ok:
-        data = resp.json()["data"]
-        return [[r["id"], r["name"], r["rate"], r["description"]] for r in data]
-    return []
+    try:
+        data = _cached_get("/points/rules", x_api_key)
+    except RuntimeError:
+        return []
+    return [[r["id"], r["name"], r["rate"], r["description"]] for r in data]
 
 def create_point_rule(x_api_key, name, rate, description):
-    resp = requests.post(
-        f"{API_BASE}/points/rules",
-        headers={"x-api-key": x_api_key},
+    resp = _request(
+        "POST", "/points/rules", x_api_key,
         params={"name": name, "rate": rate, "description": description}
     )
     if resp.ok:
+        _invalidate(x_api_key)
         return resp.json()["message"]
     return resp.text
 
-def list_transactions(x_api_key):
-    resp = requests.get(f"{API_BASE}/points/transactions", headers={"x-api-key": x_api_key})
-    if resp.ok:
-        data = resp.json()["data"]
-        return [[l["id"], l["uid"], l["point_rule_id"], l["amount"], l["balance"], str(l["detail"]), l["created_at"]] for l in data]
-    return []
+def _load_transactions(state):
+    """
+    依 state 查詢一頁流水，回傳 (rows, state, 頁面資訊)
+
+    以 id keyset 分頁：多取一筆判斷是否還有下一頁，下一頁帶入本頁最後一筆的 id 作為 before_id
+    """
+    params = dict(state["filters"], limit=state["page_size"] + 1)
+    if state["cursors"][-1] is not None:
+        params["before_id"] = state["cursors"][-1]
+    try:
+        data = _cached_get("/points/transactions", state["x_api_key"], params)
+    except RuntimeError as e:
+        return [], state, f"查詢失敗：{e}"
+    page = data[:state["page_size"]]
+    state["next"] = page[-1]["id"] if len(data) > state["page_size"] else None
+    rows = [[l["id"], l["uid"], l["point_rule_id"], l["amount"], l["balance"], str(l["detail"]), l["created_at"]] for l in page]
+    info = f"第 {len(state['cursors'])} 頁，{len(page)} 筆" + ("" if state["next"] else "（最後一頁）")
+    return rows, state, info
+
+def search_transactions(x_api_key, uid, point_rule_id, start, end, page_size):
+    filters = {}
+    if uid and uid.strip():
+        filters["uid"] = uid.strip()
+    if point_rule_id:
+        filters["point_rule_id"] = int(point_rule_id)
+    if start and start.strip():
+        filters["start"] = start.strip()
+    if end and end.strip():
+        filters["end"] = end.strip()
+    state = {"x_api_key": x_api_key, "filters": filters, "page_size": int(page_size), "cursors": [None], "next": None}
+    return _load_transactions(state)
+
+def next_transactions(state):
+    if not state or state["next"] is None:
+        return gr.update(), state, gr.update()
+    state["cursors"].append(state["next"])
+    return _load_transactions(state)
+
+def prev_transactions(state):
+    if not state or len(state["cursors"]) <= 1:
+        return gr.update(), state, gr.update()
+    state["cursors"].pop()
+    return _load_transactions(state)
 
 def create_transaction(x_api_key, uid, point_rule_id, amount, detail):
-    import json
     try:
         detail_json = json.loads(detail) if detail else {}
     except Exception:
         return "detail 必須為合法 JSON"
-    resp = requests.post(
-        f"{API_BASE}/points/transactions",
-        headers={"x-api-key": x_api_key},
+    resp = _request(
+        "POST", "/points/transactions", x_api_key,
         params={"uid": uid, "point_rule_id": point_rule_id, "amount": amount},
         json={"detail": detail_json}
     )
     if resp.ok:
+        _invalidate(x_api_key)
         return resp.json()["message"]
     return resp.text
 
@@ -93,9 +191,26 @@ with gr.Blocks() as demo:
         btn_create_rule.click(fn=create_point_rule, inputs=[x_api_key, name, rate, desc], outputs=msg_rule)
     with gr.Tab("Transactions"):
         x_api_key2 = gr.Textbox(label="x-api-key")
+        with gr.Row():
+            filter_uid = gr.Textbox(label="UID（選填）")
+            filter_rule = gr.Number(label="Point Rule ID（選填）", value=None, precision=0)
+            filter_start = gr.Textbox(label="Start（選填，如 2024-01-01 或 2024-01-01T08:00）")
+            filter_end = gr.Textbox(label="End（選填，不含）")
+            page_size = gr.Dropdown(label="Page Size", choices=PAGE_SIZES, value=PAGE_SIZES[1])
+        tx_state = gr.State(None)
+        btn_tx = gr.Button("Search Transactions")
         tx_out = gr.Dataframe(headers=["id", "uid", "point_rule_id", "amount", "balance", "detail", "created_at"])
-        btn_tx = gr.Button("List Transactions")
-        btn_tx.click(fn=list_transactions, inputs=x_api_key2, outputs=tx_out)
+        with gr.Row():
+            btn_prev = gr.Button("Previous")
+            page_info = gr.Textbox(label="Page", interactive=False)
+            btn_next = gr.Button("Next")
+        btn_tx.click(
+            fn=search_transactions,
+            inputs=[x_api_key2, filter_uid, filter_rule, filter_start, filter_end, page_size],
+            outputs=[tx_out, tx_state, page_info],
+        )
+        btn_prev.click(fn=prev_transactions, inputs=tx_state, outputs=[tx_out, tx_state, page_info])
+        btn_next.click(fn=next_transactions, inputs=tx_state, outputs=[tx_out, tx_state, page_info])
         uid = gr.Textbox(label="UID")
         point_rule_id = gr.Number(label="Point Rule ID")
         amount = gr.Number(label="Amount")